@@ -1,29 +1,26 @@
 import asyncio
-import pygame
-import random
 import time
 import webbrowser
 import os
-import http.server
-import socketserver
 import threading
 import sys
 import json
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioRestException
+import collections
+import secrets
+import hashlib
+import sqlite3
+import urllib.parse
+from puzzle_library import open_library
+from stage_profiler import PROFILE_FILE, PROFILER
+from stats_store import open_stats
+from sudoku_engine import SYMBOLS, PuzzleCache, SudokuEngine, difficulty_settings, make_puzzle_pool, parse_puzzle_code, puzzle_code, resume_session
 
-pygame.init()
-pygame.mixer.init()
-try:
-    error_sound = pygame.mixer.Sound("error.wav")
-    success_sound = pygame.mixer.Sound("success.wav")
-except:
-    error_sound = None
-    success_sound = None
-try:
-    logo_img = pygame.image.load("Background.png")
-except:
-    logo_img = None
+# pygame, the display, fonts and logo are set up by init_display() when the UI starts and
+# sounds by a background thread started from it, so importing the module stays cheap.
+pygame = None
+error_sound = None
+success_sound = None
+logo_img = None
 
 # Load Twilio configuration (replace with actual credentials or environment variables)
 try:
@@ -34,6 +31,15 @@ except ImportError:
     TWILIO_WHATSAPP_NUMBER = os.getenv('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886')
     PLAYER_WHATSAPP_NUMBER = os.getenv('PLAYER_WHATSAPP_NUMBER', 'whatsapp:+**********')
 
+INACTIVITY_MESSAGE = "Hei, a trecut ceva timp de când ai jucat ultima dată sudoku. Intoarce-te și rezolvă puzzle-ul!"
+# "twilio" sends real WhatsApp messages, "stub" only records them locally
+NOTIFY_TRANSPORT = os.getenv('SUDOKU_NOTIFY_TRANSPORT', 'twilio')
+NOTIFY_QUEUE_SIZE = 8
+NOTIFY_MAX_ATTEMPTS = 4
+NOTIFY_RETRY_DELAY = 1.0
+# Seconds after which a queued message is given up, including retries
+NOTIFY_SEND_DEADLINE = 30.0
+
 HEADER_HEIGHT = 60
 WHITE = (255, 255, 255)
 LINE_COLOR = (0, 0, 0)
@@ -41,119 +47,436 @@ SELECTED_COLOR = (200, 200, 255)
 ERROR_COLOR = (255, 0, 0)
 SUCCESS_COLOR = (0, 255, 0)
 SELECTED_OPACITY = 128
-FONT = pygame.font.Font(None, 40)
-NOTE_FONT = pygame.font.Font(None, 25)
-TITLE_FONT = pygame.font.Font(None, 80)
+FONT = None
+NOTE_FONT = None
+TITLE_FONT = None
+SMALL_NOTE_FONT = None
+GLYPH_CACHE_SIZE = 1024
+# Longest idle input wait while other asyncio tasks share the game's event loop
+SHARED_LOOP_WAIT = 0.02
+# Push only changed regions with display.update(rects) instead of flipping every frame
+DIRTY_RENDERING = os.getenv('SUDOKU_DIRTY_RENDERING', '1') != '0'
 
-DIFFICULTIES = {
-    "usor": 30,
-    "mediu": 40,
-    "greu": 55
-}
+class GlyphCache:
+    # Rendered text surfaces keyed by (font, text, color), evicted least recently used
+    def __init__(self, max_size=GLYPH_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
-CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-PAYMENT_SUCCESS_FILE = os.path.join(CURRENT_DIR, "payment_success.txt")
-SERVER_RUNNING = threading.Event()
-SERVER_RUNNING.set()
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"entries": len(self.surfaces), "hits": self.hits, "misses": self.misses, "hit_rate": round(self.hit_rate(), 4)}
+
+GLYPHS = GlyphCache()
+
+class FrameScheduler:
+    # Runs frames at full FPS only while something is animating or input was just
+    # handled; otherwise blocks on pygame's event queue until the next timer tick, so an
+    # idle game or menu wakes about once a second.
+    def __init__(self, fps=60):
+        self.frame_time = 1.0 / fps
+        self.last_frame = time.perf_counter()
+        self.pending = []
+        self.wakeup_times = collections.deque()
+        self.total_wakeups = 0
+
+    def get_events(self):
+        events = self.pending + pygame.event.get()
+        self.pending = []
+        return events
+
+    def block_for_input(self, timeout):
+        event = pygame.event.wait(max(1, int(timeout * 1000)))
+        if event.type != pygame.NOEVENT:
+            self.pending.append(event)
 
-class PaymentRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def log_message(self, format, *args):
-        pass
+    def frame_delay(self):
+        return max(0.0, self.frame_time - (time.perf_counter() - self.last_frame))
 
-    def do_POST(self):
-        if self.path == '/confirm_payment':
+    def record_wakeup(self):
+        now = time.perf_counter()
+        self.last_frame = now
+        self.total_wakeups += 1
+        self.wakeup_times.append(now)
+        while self.wakeup_times and now - self.wakeup_times[0] > 1.0:
+            self.wakeup_times.popleft()
+
+    def wait(self, busy, timeout=1.0):
+        if busy:
+            time.sleep(self.frame_delay())
+        else:
+            self.block_for_input(timeout)
+        self.record_wakeup()
+
+    async def next_frame(self, busy, timeout=1.0):
+        if busy:
+            await asyncio.sleep(self.frame_delay())
+        else:
+            # Blocking on pygame stalls the event loop, so other tasks (such as open
+            # payment server connections) cap how long one wait may last.
+            if len(asyncio.all_tasks()) > 1:
+                timeout = min(timeout, SHARED_LOOP_WAIT)
+            self.block_for_input(timeout)
+            await asyncio.sleep(0)
+        self.record_wakeup()
+
+    def wakeups_per_second(self):
+        now = time.perf_counter()
+        while self.wakeup_times and now - self.wakeup_times[0] > 1.0:
+            self.wakeup_times.popleft()
+        return len(self.wakeup_times)
+
+def init_display():
+    global pygame, FONT, NOTE_FONT, TITLE_FONT, SMALL_NOTE_FONT, logo_img
+    import pygame
+    pygame.display.init()
+    pygame.font.init()
+    FONT = pygame.font.Font(None, 40)
+    NOTE_FONT = pygame.font.Font(None, 25)
+    TITLE_FONT = pygame.font.Font(None, 80)
+    SMALL_NOTE_FONT = pygame.font.Font(None, 20)
+    try:
+        logo_img = pygame.image.load(os.path.join(CURRENT_DIR, "Background.png"))
+    except (pygame.error, FileNotFoundError):
+        logo_img = None
+    threading.Thread(target=load_audio, daemon=True).start()
+
+def load_audio():
+    global error_sound, success_sound
+    try:
+        pygame.mixer.init()
+        error_sound = pygame.mixer.Sound(os.path.join(CURRENT_DIR, "error.wav"))
+        success_sound = pygame.mixer.Sound(os.path.join(CURRENT_DIR, "success.wav"))
+    except (pygame.error, FileNotFoundError) as e:
+        print(f"Sound disabled: {e}")
+
+class TwilioTransport:
+    # The Twilio SDK is imported on the first send, which already runs in an executor thread
+    def __init__(self, account_sid, auth_token, from_number):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.client = None
+
+    def send(self, to, body):
+        if self.client is None:
+            from twilio.rest import Client
+            self.client = Client(self.account_sid, self.auth_token)
+        message = self.client.messages.create(body=body, from_=self.from_number, to=to)
+        return message.sid
+
+class StubTransport:
+    # Records messages instead of sending them, for running without network or credentials
+    def __init__(self, failures=0, delay=0.0):
+        self.failures = failures
+        self.delay = delay
+        self.sent = []
+
+    def send(self, to, body):
+        time.sleep(self.delay)
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("stub transport failure")
+        self.sent.append((to, body))
+        return f"stub-{len(self.sent)}"
+
+def make_notification_transport():
+    if NOTIFY_TRANSPORT == "stub":
+        return StubTransport()
+    return TwilioTransport(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER)
+
+class NotificationDispatcher:
+    # Sends messages off the event loop: enqueue() never blocks, a short-lived task drains
+    # the bounded queue and runs each blocking transport.send in the default executor,
+    # retrying with exponential backoff until the message's send deadline.
+    def __init__(self, transport, max_queue=NOTIFY_QUEUE_SIZE, max_attempts=NOTIFY_MAX_ATTEMPTS, retry_delay=NOTIFY_RETRY_DELAY, send_deadline=NOTIFY_SEND_DEADLINE):
+        self.transport = transport
+        self.queue = collections.deque()
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.send_deadline = send_deadline
+        self.worker = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def enqueue(self, to, body):
+        if self.transport is None:
+            return False
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            print("Notification queue full, dropping message")
+            return False
+        self.queue.append((to, body, time.monotonic() + self.send_deadline))
+        # The worker only exists while there is something to send, so an idle game
+        # keeps the event loop free for the frame scheduler.
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.get_running_loop().create_task(self.drain())
+        return True
+
+    async def drain(self):
+        while self.queue:
+            to, body, deadline = self.queue.popleft()
+            if await self.deliver(to, body, deadline):
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    async def deliver(self, to, body, deadline):
+        loop = asyncio.get_running_loop()
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
             try:
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                print(f"Received POST data: {post_data.decode('utf-8')}")
-                data = json.loads(post_data.decode('utf-8'))
-                chances = data.get('chances')
-                if chances in ['10', '25']:
-                    with open(PAYMENT_SUCCESS_FILE, "w") as f:
-                        f.write(str(chances))
-                        f.flush()
-                        os.fsync(f.fileno())
-                    print(f"Successfully wrote to {PAYMENT_SUCCESS_FILE}")
-                    self.send_response(200)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(b'{"status": "success"}')
-                else:
-                    print(f"Invalid chances value: {chances}")
-                    self.send_response(400)
-                    self.end_headers()
-                    self.wfile.write(b'{"error": "Invalid chances"}')
-            except json.JSONDecodeError as e:
-                print(f"JSON decode error: {e}")
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b'{"error": "Invalid JSON"}')
+                sid = await asyncio.wait_for(loop.run_in_executor(None, self.transport.send, to, body), remaining)
+                print(f"WhatsApp message sent: SID {sid}")
+                return True
+            except asyncio.TimeoutError:
+                print(f"WhatsApp message timed out on attempt {attempt}")
+                break
             except Exception as e:
-                print(f"Server error: {e}")
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(f'{"error": "Server error: {e}"}'.encode('utf-8'))
-        else:
-            self.send_response(404)
-            self.end_headers()
-
-httpd = None
-
-def start_server():
-    global httpd
-    Handler = PaymentRequestHandler
-    os.chdir(CURRENT_DIR)
-    httpd = socketserver.TCPServer(("", 8000), Handler)
-    print("Serving payment page at http://localhost:8000 from directory:", os.getcwd())
-    while SERVER_RUNNING.is_set():
-        httpd.handle_request()
-    httpd.server_close()
-    print("HTTP server stopped")
-
-server_thread = threading.Thread(target=start_server, daemon=True)
-server_thread.start()
-
-def generate_solved_grid(grid_size=9, box_size=3):
-    def is_valid(grid, row, col, num):
-        for i in range(grid_size):
-            if grid[row][i] == num or grid[i][col] == num:
+                print(f"Failed to send WhatsApp message (attempt {attempt}/{self.max_attempts}): {e}")
+            if attempt < self.max_attempts:
+                await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+                delay *= 2
+        print("Giving up on WhatsApp message")
+        return False
+
+    async def stop(self):
+        if self.worker and not self.worker.done():
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+
+    def stats(self):
+        return {"queued": len(self.queue), "sent": self.sent, "failed": self.failed, "dropped": self.dropped}
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Move journal of the game in progress, offered as "Continuă" after a quit or crash ('' disables it)
+SAVE_FILE = os.getenv('SUDOKU_SAVE_FILE', os.path.join(CURRENT_DIR, "savegame.jsonl"))
+# Optional append-only, fsync'd log of confirmed payments (empty disables it)
+PAYMENT_AUDIT_LOG = os.getenv('SUDOKU_PAYMENT_AUDIT_LOG', '')
+PAYMENT_TIMEOUT = 60
+PAYMENT_PORT = 8000
+# Seconds before a payment server that failed to bind tries again
+PAYMENT_START_RETRY = 10.0
+# Idle keep-alive connections are closed after this many seconds
+KEEP_ALIVE_TIMEOUT = 15
+STATIC_FILES = [("/payment.html", "payment.html", "text/html; charset=utf-8")]
+HTTP_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 500: "Internal Server Error"}
+
+class PaymentChannel:
+    # Hands payment confirmations from the HTTP handler straight to the waiting game code.
+    # Every purchase gets a one-time token, so a repeated or late POST can never credit
+    # chances twice or to a different purchase.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.closed = set()
+
+    def open(self, chances):
+        token = secrets.token_urlsafe(16)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            self.pending[token] = (chances, loop, future)
+        return token, future
+
+    def confirm(self, token, chances):
+        with self.lock:
+            entry = self.pending.get(token)
+            if entry is None:
+                return "duplicate" if token in self.closed else "unknown"
+            if entry[0] != chances:
+                return "mismatch"
+            del self.pending[token]
+            self.closed.add(token)
+        _, loop, future = entry
+        try:
+            loop.call_soon_threadsafe(self.resolve, future, chances)
+        except RuntimeError:
+            return "closed"
+        return "confirmed"
+
+    @staticmethod
+    def resolve(future, chances):
+        if not future.done():
+            future.set_result(chances)
+
+    def close(self, token):
+        # True when the token was still unconfirmed; False once confirm() has taken it
+        with self.lock:
+            if self.pending.pop(token, None) is None:
                 return False
-        start_row, start_col = box_size * (row // box_size), box_size * (col // box_size)
-        for i in range(start_row, start_row + box_size):
-            for j in range(start_col, start_col + box_size):
-                if grid[i][j] == num:
-                    return False
-        return True
+            self.closed.add(token)
+            return True
+
+PAYMENTS = PaymentChannel()
+
+def write_payment_audit(token, chances):
+    if not PAYMENT_AUDIT_LOG:
+        return
+    try:
+        with open(PAYMENT_AUDIT_LOG, "a") as f:
+            f.write(json.dumps({"token": token, "chances": chances, "time": time.time()}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    except OSError as e:
+        print(f"Failed to write payment audit log: {e}")
 
-    def solve(grid):
-        for row in range(grid_size):
-            for col in range(grid_size):
-                if grid[row][col] == 0:
-                    nums = list(range(1, grid_size + 1))
-                    random.shuffle(nums)
-                    for num in nums:
-                        if is_valid(grid, row, col, num):
-                            grid[row][col] = num
-                            if solve(grid):
-                                return True
-                            grid[row][col] = 0
-                    return False
+class PaymentServer:
+    # Asyncio HTTP/1.1 server on the game's event loop: serves the cached payment page
+    # with ETag revalidation and takes /confirm_payment POSTs, with keep-alive and any
+    # number of concurrent connections.
+    def __init__(self, host="", port=PAYMENT_PORT):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections = set()
+        self.static_files = {}
+        # time.monotonic() before which a failed start is not retried
+        self.retry_at = 0.0
+
+    def load_static_files(self):
+        for path, name, content_type in STATIC_FILES:
+            try:
+                with open(os.path.join(CURRENT_DIR, name), "rb") as f:
+                    body = f.read()
+            except OSError as e:
+                print(f"Failed to load {name}: {e}")
+                continue
+            etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+            self.static_files[path] = (body, etag, content_type)
+
+    async def start(self):
+        # Called on every game-over frame, so a failed bind is only retried after a delay
+        if self.server is not None:
+            return True
+        if time.monotonic() < self.retry_at:
+            return False
+        if not self.static_files:
+            self.load_static_files()
+        try:
+            self.server = await asyncio.start_server(self.handle_connection, self.host or None, self.port, reuse_address=True)
+        except OSError as e:
+            print(f"Failed to start payment server on port {self.port}, retrying in {PAYMENT_START_RETRY:.0f} s: {e}")
+            self.retry_at = time.monotonic() + PAYMENT_START_RETRY
+            return False
+        print(f"Serving payment page at http://localhost:{self.port}")
         return True
 
-    grid = [[0 for _ in range(grid_size)] for _ in range(grid_size)]
-    solve(grid)
-    return grid
-
-def create_puzzle(board, num_empty_cells=40):
-    puzzle = [row[:] for row in board]
-    count = 0
-    while count < num_empty_cells:
-        row = random.randint(0, len(board) - 1)
-        col = random.randint(0, len(board) - 1)
-        if puzzle[row][col] != 0:
-            puzzle[row][col] = 0
-            count += 1
-    return puzzle
+    async def stop(self):
+        if self.server is None:
+            return
+        self.server.close()
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+        self.server = None
+        print("HTTP server closed")
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = b''
+                if headers.get('content-length'):
+                    body = await reader.readexactly(int(headers['content-length']))
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                status, response_headers, payload = await self.dispatch(method, target, headers, body)
+                response_headers['Content-Length'] = str(len(payload))
+                response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+                head = f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                head += ''.join(f"{name}: {value}\r\n" for name, value in response_headers.items())
+                writer.write(head.encode('latin-1') + b'\r\n' + (payload if method != 'HEAD' else b''))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            self.connections.discard(task)
+
+    async def dispatch(self, method, target, headers, body):
+        path = urllib.parse.urlsplit(target).path
+        if path == '/confirm_payment':
+            if method != 'POST':
+                return 405, {}, b''
+            return self.confirm_payment(body)
+        if method not in ('GET', 'HEAD'):
+            return 405, {}, b''
+        static = self.static_files.get(path)
+        if static is None:
+            return 404, {}, b''
+        payload, etag, content_type = static
+        response_headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if headers.get('if-none-match') == etag:
+            return 304, response_headers, b''
+        response_headers['Content-Type'] = content_type
+        return 200, response_headers, payload
+
+    def confirm_payment(self, body):
+        def reply(status, payload):
+            return status, {'Content-Type': 'application/json'}, json.dumps(payload).encode('utf-8')
+        try:
+            print(f"Received POST data: {body.decode('utf-8')}")
+            data = json.loads(body.decode('utf-8'))
+            chances = data.get('chances')
+            token = str(data.get('token', ''))
+            if chances not in ['10', '25']:
+                print(f"Invalid chances value: {chances}")
+                return reply(400, {"error": "Invalid chances"})
+            result = PAYMENTS.confirm(token, int(chances))
+            if result != "confirmed":
+                print(f"Rejected payment {token!r}: {result}")
+                return reply(409, {"error": f"Payment {result}"})
+            print(f"Payment {token} confirmed for {chances} chances")
+            if PAYMENT_AUDIT_LOG:
+                asyncio.get_running_loop().run_in_executor(None, write_payment_audit, token, int(chances))
+            return reply(200, {"status": "success"})
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"JSON decode error: {e}")
+            return reply(400, {"error": "Invalid JSON"})
+        except Exception as e:
+            print(f"Server error: {e}")
+            return reply(500, {"error": f"Server error: {e}"})
 
 def draw_grid(screen, grid_size, box_size, screen_width, screen_height):
     block_size = screen_width // grid_size
@@ -162,253 +485,551 @@ def draw_grid(screen, grid_size, box_size, screen_width, screen_height):
         pygame.draw.line(screen, LINE_COLOR, (0, i * block_size + HEADER_HEIGHT), (screen_width, i * block_size + HEADER_HEIGHT), line_width)
         pygame.draw.line(screen, LINE_COLOR, (i * block_size, HEADER_HEIGHT), (i * block_size, HEADER_HEIGHT + screen_height), line_width)
 
+CELL_FONTS = {}
+
+def cell_fonts(block_size):
+    # Digit font, note font and note padding for a cell size: the usual 40 and 20 point
+    # fonts while they fit, shrinking with the cells on 25x25 and bigger boards
+    fonts = CELL_FONTS.get(block_size)
+    if fonts is None:
+        number_size = min(40, int(block_size * 1.1))
+        note_size = min(20, int(block_size * 0.55))
+        fonts = CELL_FONTS[block_size] = (FONT if number_size == 40 else pygame.font.Font(None, number_size),
+                                          SMALL_NOTE_FONT if note_size == 20 else pygame.font.Font(None, note_size),
+                                          min(5, block_size // 7))
+    return fonts
+
+def draw_cell_number(screen, num, row, col, block_size):
+    num_text = GLYPHS.render(cell_fonts(block_size)[0], SYMBOLS[num - 1], (0, 0, 0))
+    x = col * block_size + block_size // 2 - num_text.get_width() // 2
+    y = row * block_size + HEADER_HEIGHT + block_size // 2 - num_text.get_height() // 2
+    screen.blit(num_text, (x, y))
+
+def draw_cell_notes(screen, cell_notes, row, col, block_size, note_size):
+    _, note_font, padding = cell_fonts(block_size)
+    for note in cell_notes:
+        note_text = GLYPHS.render(note_font, SYMBOLS[note - 1], (100, 100, 100))
+        nx = col * block_size + ((note - 1) % note_size) * (block_size // note_size)
+        ny = row * block_size + HEADER_HEIGHT + ((note - 1) // note_size) * (block_size // note_size)
+        screen.blit(note_text, (nx + padding, ny + padding))
+
 def draw_numbers(screen, grid, grid_size, screen_width):
     block_size = screen_width // grid_size
     for row in range(grid_size):
         for col in range(grid_size):
             if grid[row][col] != 0:
-                num_str = str(grid[row][col]) if grid[row][col] <= 9 else chr(ord('A') + grid[row][col] - 10)
-                num_text = FONT.render(num_str, True, (0, 0, 0))
-                x = col * block_size + block_size // 2 - num_text.get_width() // 2
-                y = row * block_size + HEADER_HEIGHT + block_size // 2 - num_text.get_height() // 2
-                screen.blit(num_text, (x, y))
+                draw_cell_number(screen, grid[row][col], row, col, block_size)
 
 def draw_notes(screen, notes, grid_size, screen_width):
     block_size = screen_width // grid_size
-    note_font = pygame.font.Font(None, 20)
+    note_size = int(round(grid_size ** 0.5))
     for row in range(grid_size):
         for col in range(grid_size):
             if notes[row][col]:
-                note_size = 4 if grid_size == 16 else 3
-                for note in notes[row][col]:
-                    note_str = str(note) if note <= 9 else chr(ord('A') + note - 10)
-                    note_text = note_font.render(note_str, True, (100, 100, 100))
-                    nx = col * block_size + ((note - 1) % note_size) * (block_size // note_size)
-                    ny = row * block_size + HEADER_HEIGHT + ((note - 1) // note_size) * (block_size // note_size)
-                    screen.blit(note_text, (nx + 5, ny + 5))
+                draw_cell_notes(screen, notes[row][col], row, col, block_size, note_size)
+
+selection_surfaces = {}
+
+def key_number(key, mod, grid_size):
+    # The value a key types on this board: 1-9, then A for 10 onwards and 0 for 36,
+    # matching SYMBOLS. Shift and Ctrl combinations are left for commands.
+    if mod & (pygame.KMOD_SHIFT | pygame.KMOD_CTRL) or not 0 < key < 128:
+        return None
+    number = SYMBOLS.find(chr(key).upper()) + 1
+    return number if 1 <= number <= grid_size else None
+
+def selection_style(selected, error_cells, error_flash=False, success_flash=False):
+    row, col = selected
+    if error_flash:
+        return ERROR_COLOR, 200
+    if success_flash:
+        return SUCCESS_COLOR, 200
+    return (ERROR_COLOR if error_cells[row][col] else SELECTED_COLOR), SELECTED_OPACITY
+
+def get_selection_surface(block_size, color, opacity):
+    key = (block_size, color, opacity)
+    if key not in selection_surfaces:
+        selection_surface = pygame.Surface((block_size, block_size), pygame.SRCALPHA)
+        selection_surface.fill((*color, opacity))
+        selection_surfaces[key] = selection_surface
+    return selection_surfaces[key]
 
 def draw_selected_cell(screen, selected, grid_size, error_cells, screen_width, error_flash=False, success_flash=False):
     if selected:
         block_size = screen_width // grid_size
         row, col = selected
-        if error_flash:
-            color = ERROR_COLOR
-            opacity = 200
-        elif success_flash:
-            color = SUCCESS_COLOR
-            opacity = 200
-        else:
-            color = ERROR_COLOR if error_cells[row][col] else SELECTED_COLOR
-            opacity = SELECTED_OPACITY
-        selection_surface = pygame.Surface((block_size, block_size), pygame.SRCALPHA)
-        selection_surface.fill((*color, opacity))
-        screen.blit(selection_surface, (col * block_size, row * block_size + HEADER_HEIGHT))
+        color, opacity = selection_style(selected, error_cells, error_flash, success_flash)
+        screen.blit(get_selection_surface(block_size, color, opacity), (col * block_size, row * block_size + HEADER_HEIGHT))
 
 def draw_header(screen, elapsed_seconds, note_mode, max_mistakes, screen_width):
     pygame.draw.rect(screen, (230, 230, 230), (0, 0, screen_width, HEADER_HEIGHT))
-    title_text = FONT.render("Sudoku", True, (0, 0, 0))
+    title_text = GLYPHS.render(FONT, "Sudoku", (0, 0, 0))
     screen.blit(title_text, (screen_width // 2 - title_text.get_width() // 2, 15))
 
     note_status = "ON" if note_mode else "OFF"
-    note_text = NOTE_FONT.render(f"Notițe: {note_status}", True, (0, 255, 0) if note_status == "ON" else (25, 0, 0))
+    note_text = GLYPHS.render(NOTE_FONT, f"Notițe: {note_status}", (0, 255, 0) if note_status == "ON" else (25, 0, 0))
     screen.blit(note_text, (screen_width - 350, 40))
 
     minutes = elapsed_seconds // 60
     seconds = elapsed_seconds % 60
-    time_text = FONT.render(f"{minutes:02}:{seconds:02}", True, (0, 0, 0))
+    time_text = GLYPHS.render(FONT, f"{minutes:02}:{seconds:02}", (0, 0, 0))
     screen.blit(time_text, (screen_width - 100, 15))
 
-    mistakes_text = NOTE_FONT.render(f"Greșeli rămase: {max_mistakes}", True, (0, 0, 0))
+    mistakes_text = GLYPHS.render(NOTE_FONT, f"Greșeli rămase: {max_mistakes}", (0, 0, 0))
     screen.blit(mistakes_text, (screen_width - 160, 40))
 
     mouse_pos = pygame.mouse.get_pos()
     menu_rect = pygame.Rect(10, 10, 90, 40)
     menu_color = (220, 220, 255) if menu_rect.collidepoint(mouse_pos) else (180, 180, 180)
     pygame.draw.rect(screen, menu_color, menu_rect, border_radius=6)
-    menu_text = FONT.render("Meniu", True, (0, 0, 0))
+    menu_text = GLYPHS.render(FONT, "Meniu", (0, 0, 0))
     screen.blit(menu_text, (15, 15))
 
     reset_rect = pygame.Rect(115, 10, 90, 40)
     reset_color = (220, 220, 255) if reset_rect.collidepoint(mouse_pos) else (180, 180, 180)
     pygame.draw.rect(screen, reset_color, reset_rect, border_radius=6)
-    reset_text = FONT.render("Reset", True, (0, 0, 0))
+    reset_text = GLYPHS.render(FONT, "Reset", (0, 0, 0))
     screen.blit(reset_text, (120, 15))
 
-def is_valid_move(grid, row, col, num, box_size):
-    for i in range(len(grid)):
-        if i != col and grid[row][i] == num:
-            return False
-        if i != row and grid[i][col] == num:
-            return False
-    start_row, start_col = box_size * (row // box_size), box_size * (col // box_size)
-    for i in range(start_row, start_row + box_size):
-        for j in range(start_col, start_col + box_size):
-            if (i != row or j != col) and grid[i][j] == num:
-                return False
-    return True
+class BoardRenderer:
+    # Dirty-rectangle renderer: grid lines and givens are pre-rendered into a background
+    # surface, and each frame only the cells and header whose content changed are
+    # redrawn and pushed to the display. The givens come separately from the grid, which
+    # already holds the player's digits when a saved game is resumed.
+    def __init__(self, grid, givens, grid_size, box_size, screen_width, screen_height):
+        self.grid_size = grid_size
+        self.box_size = box_size
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.block_size = screen_width // grid_size
+        self.note_size = box_size
+        self.givens = [[bool(given) for given in row] for row in givens]
+        self.background = pygame.Surface((screen_width, screen_height))
+        self.background.fill(WHITE)
+        draw_grid(self.background, grid_size, box_size, screen_width, screen_height - HEADER_HEIGHT)
+        draw_numbers(self.background, [[num if given else 0 for num, given in zip(row, given_row)]
+                                       for row, given_row in zip(grid, self.givens)], grid_size, screen_width)
+        self.header_rect = pygame.Rect(0, 0, screen_width, HEADER_HEIGHT)
+        self.cell_states = None
+        self.header_state = None
+        self.full_redraw = True
 
-def check_sudoku(grid, grid_size):
-    for i in range(grid_size):
-        row = [grid[i][j] for j in range(grid_size) if grid[i][j] != 0]
-        col = [grid[j][i] for j in range(grid_size) if grid[j][i] != 0]
-        if len(row) != len(set(row)) or len(col) != len(set(col)):
-            return False
-    box_size = 4 if grid_size == 16 else 3
-    for row in range(0, grid_size, box_size):
-        for col in range(0, grid_size, box_size):
-            subgrid = [grid[r][c] for r in range(row, row + box_size) for c in range(col, col + box_size) if grid[r][c] != 0]
-            if len(subgrid) != len(set(subgrid)):
-                return False
-    return all(grid[r][c] != 0 for r in range(grid_size) for c in range(grid_size))
+    def invalidate(self):
+        self.full_redraw = True
+
+    def cell_rect(self, row, col):
+        return pygame.Rect(col * self.block_size, row * self.block_size + HEADER_HEIGHT, self.block_size, self.block_size)
+
+    def draw(self, screen, grid, notes, selected, error_cells, elapsed_seconds, note_mode, max_mistakes, error_flash=False, success_flash=False):
+        # Returns the list of changed rects, or None when the whole screen was redrawn
+        style = selection_style(selected, error_cells, error_flash, success_flash) if selected else None
+        cell_states = [[(num, frozenset(cell_notes), None) for num, cell_notes in zip(grid[row], notes[row])]
+                       for row in range(self.grid_size)]
+        if selected:
+            row, col = selected
+            cell_states[row][col] = cell_states[row][col][:2] + (style,)
+        mouse_pos = pygame.mouse.get_pos()
+        header_state = (elapsed_seconds, note_mode, max_mistakes,
+                        pygame.Rect(10, 10, 90, 40).collidepoint(mouse_pos), pygame.Rect(115, 10, 90, 40).collidepoint(mouse_pos))
+        PROFILER.lap("draw_state")
+
+        rects = None
+        if self.full_redraw:
+            screen.fill(WHITE)
+            draw_header(screen, elapsed_seconds, note_mode, max_mistakes, self.screen_width)
+            PROFILER.lap("draw_header")
+            draw_grid(screen, self.grid_size, self.box_size, self.screen_width, self.screen_height - HEADER_HEIGHT)
+            PROFILER.lap("draw_grid")
+            draw_numbers(screen, grid, self.grid_size, self.screen_width)
+            PROFILER.lap("draw_numbers")
+            draw_notes(screen, notes, self.grid_size, self.screen_width)
+            PROFILER.lap("draw_notes")
+            draw_selected_cell(screen, selected, self.grid_size, error_cells, self.screen_width, error_flash, success_flash)
+            PROFILER.lap("draw_selection")
+            self.full_redraw = False
+        else:
+            rects = []
+            if header_state != self.header_state:
+                screen.set_clip(self.header_rect)
+                draw_header(screen, elapsed_seconds, note_mode, max_mistakes, self.screen_width)
+                draw_grid(screen, self.grid_size, self.box_size, self.screen_width, self.screen_height - HEADER_HEIGHT)
+                rects.append(self.header_rect)
+                PROFILER.lap("draw_header")
+            dirty = set()
+            for row in range(self.grid_size):
+                for col in range(self.grid_size):
+                    if cell_states[row][col] != self.cell_states[row][col]:
+                        dirty.update(self.neighbours(row, col))
+            for row, col in sorted(dirty):
+                rects.append(self.redraw_cell(screen, grid, notes, selected, row, col, style))
+            screen.set_clip(None)
+            PROFILER.lap("draw_cells")
+
+        self.cell_states = cell_states
+        self.header_state = header_state
+        return rects
+
+    def paint_rect(self, row, col):
+        # A cell's rect, with edge cells owning the leftover strip up to the window border
+        rect = self.cell_rect(row, col)
+        if row == self.grid_size - 1:
+            rect.height = self.screen_height - rect.top
+        if col == self.grid_size - 1:
+            rect.width = self.screen_width - rect.left
+        return rect
+
+    def damage(self, rect):
+        # Cells under something drawn on top of the board (the profiler overlay) are
+        # repainted on the next frame
+        if self.cell_states is None:
+            return
+        for row in range(self.grid_size):
+            for col in range(self.grid_size):
+                if self.paint_rect(row, col).colliderect(rect):
+                    self.cell_states[row][col] = None
+
+    def neighbours(self, row, col):
+        return [(r, c) for r in range(max(row - 1, 0), min(row + 2, self.grid_size))
+                for c in range(max(col - 1, 0), min(col + 2, self.grid_size))]
+
+    def redraw_cell(self, screen, grid, notes, selected, row, col, style):
+        # Notes can spill a few pixels into the next cell, so a change dirties the
+        # neighbouring cells and each redraw repaints whatever of the neighbours falls
+        # inside its clip, in the same order as a full redraw. Edge cells also own the
+        # leftover strip up to the window border, where the last notes can spill too.
+        rect = self.paint_rect(row, col)
+        screen.set_clip(rect)
+        screen.blit(self.background, rect, rect)
+        neighbours = self.neighbours(row, col)
+        for r, c in neighbours:
+            if grid[r][c] and not self.givens[r][c]:
+                draw_cell_number(screen, grid[r][c], r, c, self.block_size)
+        for r, c in neighbours:
+            if notes[r][c]:
+                draw_cell_notes(screen, notes[r][c], r, c, self.block_size, self.note_size)
+        if selected in neighbours:
+            color, opacity = style
+            screen.blit(get_selection_surface(self.block_size, color, opacity), self.cell_rect(*selected))
+        return rect
+
+def draw_profile_overlay(screen, screen_width, screen_height):
+    # p50/p95/p99 in ms of every stage over the last PROFILE_WINDOW samples; returns the
+    # rect it covered
+    line_height = 18
+    rows = [("etapă (ms)", "p50", "p95", "p99")]
+    for stage, summary in PROFILER.summary(whole_run=False).items():
+        rows.append((stage, f"{summary['p50_ms']:.2f}", f"{summary['p95_ms']:.2f}", f"{summary['p99_ms']:.2f}"))
+    rect = pygame.Rect(10, screen_height - 20 - line_height * len(rows), 330, line_height * len(rows) + 10)
+    overlay = pygame.Surface(rect.size, pygame.SRCALPHA)
+    overlay.fill((0, 0, 0, 190))
+    screen.blit(overlay, rect)
+    for index, row in enumerate(rows):
+        y = rect.y + 5 + index * line_height
+        # Rendered directly: the numbers change every frame and would only churn the glyph cache
+        screen.blit(SMALL_NOTE_FONT.render(row[0], True, (255, 255, 255)), (rect.x + 8, y))
+        for column, text in enumerate(row[1:]):
+            label = SMALL_NOTE_FONT.render(text, True, (255, 255, 255))
+            screen.blit(label, (rect.x + 200 + column * 60 - label.get_width(), y))
+    return rect
 
 def draw_success_message(screen, screen_width, screen_height):
-    success_text = FONT.render("Sudoku completat corect!", True, (0, 255, 0))
+    success_text = GLYPHS.render(FONT, "Sudoku completat corect!", (0, 255, 0))
     screen.blit(success_text, (screen_width // 2 - success_text.get_width() // 2, HEADER_HEIGHT + screen_height // 2))
 
-def show_menu(screen, screen_width, screen_height, max_mistakes):
+# Levels on the statistics screen, as (label, difficulty)
+STATS_LEVELS = [("Ușor", "usor"), ("Mediu", "mediu"), ("Greu", "greu"), ("4x4", "4x4"), ("5x5", "5x5"), ("6x6", "6x6")]
+
+def format_time(seconds):
+    return f"{seconds // 60:02}:{seconds % 60:02}"
+
+def show_stats(screen, screen_width, screen_height, stats, scheduler):
+    # Games, solves, best and average time and streaks per level, and the fastest solves of
+    # the level clicked. Every figure is an indexed lookup, so they are only re-read when
+    # the selection changes. Returns False on QUIT. The writer is woken rather than waited
+    # for: the last committed figures show at once and are re-read once it has drained.
+    pending = not stats.flush(0)
+    selected = "usor"
+    summaries = None
+    best_times = None
+    back_rect = pygame.Rect(200, 590, 200, 50)
+    columns = [("Nivel", 30), ("Jocuri", 130), ("Rezolvate", 215), ("Record", 325), ("Medie", 415), ("Serie", 500)]
+
+    def row_rect(index):
+        return pygame.Rect(20, 112 + index * 36, 560, 32)
+
+    while True:
+        if pending and stats.drained.is_set():
+            pending = False
+            summaries = best_times = None
+        if best_times is None:
+            try:
+                if summaries is None:
+                    summaries = {dificultate: stats.summary(difficulty_settings(dificultate)[0], dificultate) for _, dificultate in STATS_LEVELS}
+                best_times = stats.best_times(difficulty_settings(selected)[0], selected, 5)
+            except sqlite3.Error as e:
+                print(f"Stats not read: {e}")
+                summaries, best_times = {}, []
+
+        screen.fill(WHITE)
+        title = GLYPHS.render(TITLE_FONT, "Statistici", (0, 0, 0))
+        screen.blit(title, (screen_width // 2 - title.get_width() // 2, 20))
+        mouse_pos = pygame.mouse.get_pos()
+        for text, x in columns:
+            screen.blit(GLYPHS.render(NOTE_FONT, text, (100, 100, 100)), (x, 88))
+        for index, (label, dificultate) in enumerate(STATS_LEVELS):
+            rect = row_rect(index)
+            if dificultate == selected:
+                pygame.draw.rect(screen, (200, 200, 255), rect, border_radius=6)
+            elif rect.collidepoint(mouse_pos):
+                pygame.draw.rect(screen, (230, 230, 250), rect, border_radius=6)
+            summary = summaries.get(dificultate)
+            if summary:
+                cells = [label, str(summary["played"]), str(summary["solved"]),
+                         format_time(summary["best"]) if summary["best"] is not None else "-",
+                         format_time(int(round(summary["average"]))) if summary["average"] is not None else "-",
+                         f"{summary['streak']} / {summary['longest_streak']}"]
+            else:
+                cells = [label] + ["-"] * 5
+            for text, (_, x) in zip(cells, columns):
+                screen.blit(GLYPHS.render(NOTE_FONT, text, (0, 0, 0)), (x, rect.y + 8))
+
+        label = next(label for label, dificultate in STATS_LEVELS if dificultate == selected)
+        heading = GLYPHS.render(FONT, f"Cei mai buni timpi: {label}", (0, 0, 0))
+        screen.blit(heading, (screen_width // 2 - heading.get_width() // 2, 340))
+        if not best_times:
+            empty = GLYPHS.render(NOTE_FONT, "Niciun joc rezolvat încă", (120, 120, 120))
+            screen.blit(empty, (screen_width // 2 - empty.get_width() // 2, 385))
+        for rank, (elapsed, mistakes, finished_at) in enumerate(best_times, 1):
+            y = 385 + (rank - 1) * 36
+            # Not cached: each date and time is drawn on this screen only
+            for text, x in ((f"{rank}.", 110), (format_time(elapsed), 150), (f"{mistakes} greșeli", 260),
+                            (time.strftime("%d.%m.%Y", time.localtime(finished_at)), 390)):
+                screen.blit(NOTE_FONT.render(text, True, (0, 0, 0)), (x, y))
+
+        pygame.draw.rect(screen, (220, 220, 255) if back_rect.collidepoint(mouse_pos) else (150, 150, 150), back_rect, border_radius=8)
+        back_text = GLYPHS.render(FONT, "Înapoi", (0, 0, 0))
+        screen.blit(back_text, (back_rect.centerx - back_text.get_width() // 2, back_rect.y + 10))
+
+        events = scheduler.get_events()
+        for event in events:
+            if event.type == pygame.QUIT:
+                return False
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                return True
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                if back_rect.collidepoint(event.pos):
+                    return True
+                for index, (_, dificultate) in enumerate(STATS_LEVELS):
+                    if row_rect(index).collidepoint(event.pos) and dificultate != selected:
+                        selected = dificultate
+                        best_times = None
+        pygame.display.flip()
+        scheduler.wait(bool(events), 0.1 if pending else 1.0)
+
+def show_menu(screen, screen_width, screen_height, max_mistakes, puzzle_pool=None, scheduler=None, can_resume=False, stats=None):
     running = True
+    scheduler = scheduler or FrameScheduler()
     current_max_mistakes = max_mistakes  # Initialize with the passed max_mistakes
+    # The big boards share one row: 16x16, 25x25 and 36x36, named by their box size. Only
+    # Ușor, Mediu and Greu are graded by the techniques they need (TECHNIQUE_BANDS); the
+    # big boards differ by how many cells are blank.
     buttons = [
-        ("Ușor", 120),
-        ("Mediu", 200),
-        ("Greu", 280),
-        ("4x4", 360),
-        ("Ieșire", 440)
+        ("Ușor", pygame.Rect(200, 120, 200, 50)),
+        ("Mediu", pygame.Rect(200, 200, 200, 50)),
+        ("Greu", pygame.Rect(200, 280, 200, 50)),
+        ("4x4", pygame.Rect(90, 360, 130, 50)),
+        ("5x5", pygame.Rect(235, 360, 130, 50)),
+        ("6x6", pygame.Rect(380, 360, 130, 50))
     ]
+    # A saved game and the statistics share the last row with Ieșire
+    last_row = (["Continuă"] if can_resume else []) + (["Statistici"] if stats else []) + ["Ieșire"]
+    if len(last_row) == 1:
+        buttons.append(("Ieșire", pygame.Rect(200, 440, 200, 50)))
+    else:
+        width = (420 - 15 * (len(last_row) - 1)) // len(last_row)
+        buttons += [(text, pygame.Rect(90 + index * (width + 15), 440, width, 50)) for index, text in enumerate(last_row)]
     button_colors = {
         "Ușor": (100, 200, 100),
         "Mediu": (240, 200, 100),
         "Greu": (220, 80, 80),
         "4x4": (200, 40, 40),
-        "Ieșire": (150, 150, 150)
+        "5x5": (170, 30, 30),
+        "6x6": (140, 20, 20),
+        "Ieșire": (150, 150, 150),
+        "Continuă": (100, 160, 220),
+        "Statistici": (190, 160, 220)
     }
     hover_color = (220, 220, 255)
+    # Puzzle code field: a bare seed is played at the difficulty clicked next, and Enter
+    # plays a full "difficulty:seed" code (a bare seed at Mediu)
+    seed_rect = pygame.Rect(150, 580, 300, 30)
+    seed_text = ""
+    seed_active = False
 
     while running:
         screen.fill(WHITE)
         if logo_img:
             screen.blit(logo_img, (screen_width // 2 - logo_img.get_width() // 2, 20))
-        title = TITLE_FONT.render("Sudoku!", True, (0, 0, 0))
+        title = GLYPHS.render(TITLE_FONT, "Sudoku!", (0, 0, 0))
         screen.blit(title, (screen_width // 2 - title.get_width() // 2, 25))
 
         mouse_pos = pygame.mouse.get_pos()
-        for text, y in buttons:
-            button_rect = pygame.Rect(200, y, 200, 50)
+        for text, button_rect in buttons:
             color = hover_color if button_rect.collidepoint(mouse_pos) else button_colors.get(text, (180, 180, 180))
             pygame.draw.rect(screen, color, button_rect, border_radius=8)
-            label = FONT.render(text, True, (0, 0, 0))
-            screen.blit(label, (screen_width // 2 - label.get_width() // 2, y + 10))
+            label = GLYPHS.render(FONT, text, (0, 0, 0))
+            screen.blit(label, (button_rect.centerx - label.get_width() // 2, button_rect.y + 10))
 
         selector_y = 540
         minus_rect = pygame.Rect(148, selector_y, 30, 30)
         plus_rect = pygame.Rect(424, selector_y, 30, 30)
-        mistakes_text = FONT.render(f"Greșeli permise: {current_max_mistakes}", True, (0, 0, 0))
+        mistakes_text = GLYPHS.render(FONT, f"Greșeli permise: {current_max_mistakes}", (0, 0, 0))
         screen.blit(mistakes_text, (screen_width // 2 - mistakes_text.get_width() // 2, selector_y))
 
         pygame.draw.rect(screen, hover_color if minus_rect.collidepoint(mouse_pos) else (200, 200, 200), minus_rect, border_radius=6)
-        minus = FONT.render("-", True, (0, 0, 0))
+        minus = GLYPHS.render(FONT, "-", (0, 0, 0))
         screen.blit(minus, (158, selector_y))
 
         pygame.draw.rect(screen, hover_color if plus_rect.collidepoint(mouse_pos) else (200, 200, 200), plus_rect, border_radius=6)
-        plus = FONT.render("+", True, (0, 0, 0))
+        plus = GLYPHS.render(FONT, "+", (0, 0, 0))
         screen.blit(plus, (430, selector_y))
 
-        for event in pygame.event.get():
+        pygame.draw.rect(screen, (255, 255, 255), seed_rect, border_radius=6)
+        pygame.draw.rect(screen, (80, 80, 200) if seed_active else (150, 150, 150), seed_rect, 2, border_radius=6)
+        if seed_text or seed_active:
+            seed_label = GLYPHS.render(NOTE_FONT, seed_text + ("|" if seed_active else ""), (0, 0, 0))
+        else:
+            seed_label = GLYPHS.render(NOTE_FONT, "Cod puzzle (opțional)", (150, 150, 150))
+        screen.blit(seed_label, (seed_rect.x + 8, seed_rect.y + 7))
+
+        if puzzle_pool:
+            pool_stats = puzzle_pool.stats()
+            pool_text = GLYPHS.render(NOTE_FONT, f"Puzzle-uri pregătite: {sum(pool_stats['ready'].values())}  (hit {pool_stats['hits']} / miss {pool_stats['misses']})", (120, 120, 120))
+            screen.blit(pool_text, (screen_width // 2 - pool_text.get_width() // 2, 610))
+
+        events = scheduler.get_events()
+        for event in events:
             if event.type == pygame.QUIT:
-                return None, current_max_mistakes
+                return None, current_max_mistakes, None
+            if event.type == pygame.KEYDOWN and seed_active:
+                if event.key == pygame.K_RETURN and seed_text:
+                    dificultate, seed = parse_puzzle_code(seed_text)
+                    if seed:
+                        return dificultate or "mediu", current_max_mistakes, seed
+                elif event.key == pygame.K_BACKSPACE:
+                    seed_text = seed_text[:-1]
+                elif event.key == pygame.K_ESCAPE:
+                    seed_active = False
+                elif event.unicode and (event.unicode.isalnum() or event.unicode in ":~-_") and len(seed_text) < 32:
+                    seed_text += event.unicode
             if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                 x, y = event.pos
-                for text, btn_y in buttons:
-                    button_rect = pygame.Rect(200, btn_y, 200, 50)
+                seed_active = seed_rect.collidepoint(x, y)
+                for text, button_rect in buttons:
                     if button_rect.collidepoint(x, y):
                         if text == "Ieșire":
-                            return None, current_max_mistakes
-                        return text.lower(), current_max_mistakes
+                            return None, current_max_mistakes, None
+                        if text == "Continuă":
+                            return "continua", current_max_mistakes, None
+                        if text == "Statistici":
+                            if not show_stats(screen, screen_width, screen_height, stats, scheduler):
+                                return None, current_max_mistakes, None
+                            break
+                        return text.lower().replace("ș", "s"), current_max_mistakes, parse_puzzle_code(seed_text)[1] or None
                 if minus_rect.collidepoint(x, y) and current_max_mistakes > 0:
                     current_max_mistakes -= 1
                 elif plus_rect.collidepoint(x, y) and current_max_mistakes < 99:
                     current_max_mistakes += 1
 
         pygame.display.flip()
+        if puzzle_pool:
+            # Generation competes with the UI thread, so it only begins once the menu is up
+            puzzle_pool.start()
+        # Input changes what the next frame shows, so only block once it has been drawn
+        scheduler.wait(bool(events))
 
-async def check_payment_confirmation(chances, screen, screen_width, screen_height, grid, grid_size, box_size, elapsed_seconds, note_mode, max_mistakes, selected, error_cells, notes, error_flash, success_flash):
-    print(f"Checking for payment confirmation for {chances} chances...")
-    start_time = time.time()
-    timeout = 60
-    initial_wait = True
-    max_retries = 5
-    retry_delay = 2
+def show_puzzle_code(dificultate, seed):
+    # The window title carries the code, so a puzzle can be shared or replayed from the menu
+    code = puzzle_code(dificultate, seed)
+    print(f"Puzzle code: {code}")
+    pygame.display.set_caption(f"Sudoku - {code}")
 
-    while time.time() - start_time < timeout:
+async def wait_for_puzzle(screen, screen_width, screen_height, generated):
+    # Generation runs in the pool's worker processes (or a thread), so the event loop and
+    # the payment server keep running; returns (solution, puzzle, seed), or None on QUIT
+    job = asyncio.wrap_future(generated)
+    screen.fill(WHITE)
+    loading_text = GLYPHS.render(FONT, "Se generează puzzle-ul...", (0, 0, 0))
+    screen.blit(loading_text, (screen_width // 2 - loading_text.get_width() // 2, screen_height // 2 - 20))
+    pygame.display.flip()
+    start_time = time.time()
+    while True:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                print("Quit event detected during payment confirmation")
-                return False, 0
+                print("Quit event detected while generating a puzzle")
+                return None
+        done, _ = await asyncio.wait({job}, timeout=0.1)
+        if done:
+            print(f"Puzzle generated on demand in {time.time() - start_time:.3f} seconds")
+            return job.result()
 
-        screen.fill(WHITE)
-        draw_header(screen, elapsed_seconds, note_mode, max_mistakes, screen_width)
-        draw_grid(screen, grid_size, box_size, screen_width, screen_height - HEADER_HEIGHT)
-        draw_numbers(screen, grid, grid_size, screen_width)
-        draw_notes(screen, notes, grid_size, screen_width)
-        draw_selected_cell(screen, selected, grid_size, error_cells, screen_width, error_flash, success_flash)
-        overlay = pygame.Surface((screen_width, screen_height), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 180))
-        screen.blit(overlay, (0, 0))
-        pygame.draw.rect(screen, (255, 255, 255), (100, 180, 400, 330), border_radius=10)
-        pygame.draw.rect(screen, (0, 0, 0), (100, 180, 400, 330), 2, border_radius=10)
-        processing_text = FONT.render("Procesare plată...", True, (0, 0, 255))
-        screen.blit(processing_text, (screen_width // 2 - processing_text.get_width() // 2, screen_height // 2 - 20))
-        pygame.display.flip()
+async def check_payment_confirmation(token, confirmation, chances, screen, screen_width, screen_height, grid, grid_size, box_size, elapsed_seconds, note_mode, max_mistakes, selected, error_cells, notes, error_flash, success_flash):
+    print(f"Waiting for payment confirmation for {chances} chances...")
+    start_time = time.time()
 
-        if initial_wait:
-            print("Waiting for initial delay to allow file creation...")
-            await asyncio.sleep(3)
-            initial_wait = False
+    screen.fill(WHITE)
+    draw_header(screen, elapsed_seconds, note_mode, max_mistakes, screen_width)
+    draw_grid(screen, grid_size, box_size, screen_width, screen_height - HEADER_HEIGHT)
+    draw_numbers(screen, grid, grid_size, screen_width)
+    draw_notes(screen, notes, grid_size, screen_width)
+    draw_selected_cell(screen, selected, grid_size, error_cells, screen_width, error_flash, success_flash)
+    overlay = pygame.Surface((screen_width, screen_height), pygame.SRCALPHA)
+    overlay.fill((0, 0, 0, 180))
+    screen.blit(overlay, (0, 0))
+    pygame.draw.rect(screen, (255, 255, 255), (100, 180, 400, 330), border_radius=10)
+    pygame.draw.rect(screen, (0, 0, 0), (100, 180, 400, 330), 2, border_radius=10)
+    processing_text = GLYPHS.render(FONT, "Procesare plată...", (0, 0, 255))
+    screen.blit(processing_text, (screen_width // 2 - processing_text.get_width() // 2, screen_height // 2 - 20))
+    pygame.display.flip()
 
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                if os.path.exists(PAYMENT_SUCCESS_FILE):
-                    with open(PAYMENT_SUCCESS_FILE, "r") as f:
-                        content = f.read().strip()
-                    print(f"Found file with content: {content} at {time.time() - start_time:.2f} seconds")
-                    if content == str(chances):
-                        try:
-                            os.remove(PAYMENT_SUCCESS_FILE)
-                            print(f"Payment confirmed for {chances} chances, removed {PAYMENT_SUCCESS_FILE}")
-                            return True, int(chances)
-                        except PermissionError as e:
-                            print(f"Failed to remove file: {e}")
-                            await asyncio.sleep(retry_delay)
-                            retry_count += 1
-                            continue
-                break
-            except PermissionError as e:
-                print(f"Permission error accessing file: {e} at {time.time() - start_time:.2f} seconds, retry {retry_count + 1}/{max_retries}")
-                await asyncio.sleep(retry_delay)
-                retry_count += 1
-            except Exception as e:
-                print(f"Error checking payment file: {e} at {time.time() - start_time:.2f} seconds")
+    quit_requested = False
+    try:
+        while not quit_requested and time.time() - start_time < PAYMENT_TIMEOUT:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    print("Quit event detected during payment confirmation")
+                    quit_requested = True
+            # The wait ends as soon as the server thread resolves the future; the timeout
+            # only keeps the window responsive to QUIT.
+            done, _ = await asyncio.wait({confirmation}, timeout=0.1)
+            if done:
                 break
-
-        await asyncio.sleep(0.1)
-
-    print(f"Payment confirmation timed out after {timeout} seconds")
-    return False, 0
+        # A token confirm() already took was paid for just as the wait ended, and its
+        # result is only a callback away; closing any other refuses a late POST
+        if not confirmation.done() and PAYMENTS.close(token):
+            if not quit_requested:
+                print(f"Payment confirmation timed out after {PAYMENT_TIMEOUT} seconds")
+            return False, 0
+        credited = await confirmation
+    finally:
+        PAYMENTS.close(token)
+    print(f"Payment confirmed for {credited} chances after {time.time() - start_time:.3f} seconds")
+    return True, credited
 
 async def main():
-    global httpd, SERVER_RUNNING
     SCREEN_WIDTH, SCREEN_HEIGHT = 600, 660
+    init_display()
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption('Sudoku')
     FPS = 60
-    clock = pygame.time.Clock()
+    scheduler = FrameScheduler(FPS)
 
-    try:
-        twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-    except Exception as e:
-        print(f"Failed to initialize Twilio client: {e}")
-        twilio_client = None
+    puzzle_pool = make_puzzle_pool()
+    engine = SudokuEngine(puzzle_pool, PuzzleCache(), open_library())
+    stats = open_stats()
+    payment_server = PaymentServer()
+
+    notifier = NotificationDispatcher(make_notification_transport())
 
     grid = None
     original_cells = None
@@ -422,6 +1043,7 @@ async def main():
     payment_failed = False
     last_interaction_time = time.time()
     message_sent = False
+    session = None
 
     def setup():
         nonlocal grid, original_cells, error_cells, notes, note_mode, error_flash, success_flash, flash_start, payment_failed, last_interaction_time, message_sent
@@ -437,111 +1059,157 @@ async def main():
         last_interaction_time = time.time()
         message_sent = False
 
-    async def send_whatsapp_message():
+    def send_whatsapp_message():
         nonlocal message_sent
-        if twilio_client and not message_sent:
-            try:
-                message = twilio_client.messages.create(
-                    body="Hei, a trecut ceva timp de când ai jucat ultima dată sudoku. Intoarce-te și rezolvă puzzle-ul!",
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=PLAYER_WHATSAPP_NUMBER
-                )
-                print(f"WhatsApp message sent: SID {message.sid}")
-                message_sent = True
-                return True
-            except TwilioRestException as e:
-                print(f"Failed to send WhatsApp message: {e}")
-                return False
-        return False
+        if not message_sent:
+            message_sent = notifier.enqueue(PLAYER_WHATSAPP_NUMBER, INACTIVITY_MESSAGE)
+
+    async def start_session(dificultate, seed=None, elapsed_seconds=0):
+        # Replaces the current game, which had run for elapsed_seconds; None when the
+        # window was closed while the new puzzle was generated, and the old game stays
+        generated = engine.submit(dificultate, seed)
+        if generated.done():
+            generated = generated.result()
+        else:
+            generated = await wait_for_puzzle(screen, SCREEN_WIDTH, SCREEN_HEIGHT, generated)
+            if generated is None:
+                return None
+        finish_session(elapsed_seconds)
+        new_session = engine.new_session(dificultate, max_mistakes, generated=generated)
+        if SAVE_FILE:
+            new_session.start_journal(SAVE_FILE, dificultate)
+        return new_session
+
+    def record_game(game, elapsed_seconds, result):
+        # Only queued here; the store writes it from its own thread
+        if stats:
+            stats.record(game.grid_size, game.dificultate, game.seed, elapsed_seconds, game.mistakes, game.chances_bought, result)
+
+    def finish_session(elapsed_seconds):
+        # The game a new one replaces is over: lost when out of chances, abandoned otherwise.
+        # One left in the save file by an earlier run is read back to be counted too.
+        if not stats:
+            return
+        previous = session
+        if previous is None and SAVE_FILE and os.path.exists(SAVE_FILE):
+            resumed = resume_session(SAVE_FILE)
+            if resumed:
+                previous, _, elapsed_seconds = resumed
+                previous.journal.close()
+        if previous and previous.is_started() and not previous.is_solved():
+            record_game(previous, elapsed_seconds, "lost" if previous.game_over else "abandoned")
 
     async def update_loop():
-        nonlocal grid, original_cells, error_cells, notes, note_mode, error_flash, success_flash, flash_start, max_mistakes, payment_failed, last_interaction_time, message_sent
+        nonlocal grid, original_cells, error_cells, notes, note_mode, error_flash, success_flash, flash_start, max_mistakes, payment_failed, last_interaction_time, message_sent, session
+        # F3: frame profiler overlay, which also starts recording
+        show_profile = False
+        elapsed_seconds = 0
         while True:
-            dificultate, max_mistakes = show_menu(screen, SCREEN_WIDTH, SCREEN_HEIGHT, max_mistakes)
+            dificultate, max_mistakes, seed = show_menu(screen, SCREEN_WIDTH, SCREEN_HEIGHT, max_mistakes, puzzle_pool, scheduler, bool(SAVE_FILE) and os.path.exists(SAVE_FILE), stats)
             if not dificultate:
                 break
 
-            if dificultate == "4x4":
-                grid_size = 16
-                box_size = 4
-                num_empty = 150
+            if dificultate == "continua":
+                resumed = resume_session(SAVE_FILE)
+                if not resumed:
+                    continue
+                session, dificultate, elapsed_seconds = resumed
+                max_mistakes = session.max_mistakes
+                print(f"Resumed saved game, {len(session.history)} moves can be undone")
             else:
-                grid_size = 9
-                box_size = 3
-                num_empty = DIFFICULTIES.get(dificultate, 40)
-
-            solved_grid = generate_solved_grid(grid_size, box_size)
-            grid = create_puzzle(solved_grid, num_empty_cells=num_empty)
-            original_cells = [[cell != 0 for cell in row] for row in grid]
-            error_cells = [[False for _ in range(grid_size)] for _ in range(grid_size)]
-            notes = [[set() for _ in range(grid_size)] for _ in range(grid_size)]
+                new_session = await start_session(dificultate, seed, elapsed_seconds)
+                if new_session is None:
+                    return
+                session = new_session
+                elapsed_seconds = 0
+            grid_size, box_size, _ = difficulty_settings(dificultate)
+            show_puzzle_code(dificultate, session.seed)
+            grid, original_cells, error_cells, notes = session.grid, session.original_cells, session.error_cells, session.notes
+            board_renderer = BoardRenderer(grid, original_cells, grid_size, box_size, SCREEN_WIDTH, SCREEN_HEIGHT)
             note_mode = False
             selected = None
-            start_time = time.time()
-            timer_stopped = False
-            game_over = False
+            start_time = time.time() - elapsed_seconds
+            game_over = session.game_over
+            timer_stopped = game_over
             error_flash = False
             success_flash = False
             flash_start = 0
             return_to_menu = False
+            move_made = False
             payment_failed = False
             last_interaction_time = time.time()
             message_sent = False
 
             while True:
+                PROFILER.begin_frame()
                 elapsed_seconds = int(time.time() - start_time) if not timer_stopped else elapsed_seconds
-                screen.fill(WHITE)
-                draw_header(screen, elapsed_seconds, note_mode, max_mistakes, SCREEN_WIDTH)
-                draw_grid(screen, grid_size, box_size, SCREEN_WIDTH, SCREEN_HEIGHT - HEADER_HEIGHT)
-                draw_numbers(screen, grid, grid_size, SCREEN_WIDTH)
-                draw_notes(screen, notes, grid_size, SCREEN_WIDTH)
-                draw_selected_cell(screen, selected, grid_size, error_cells, SCREEN_WIDTH, error_flash, success_flash)
+                if session.journal:
+                    session.journal.maybe_flush(elapsed_seconds)
+                PROFILER.lap("journal")
+                if not DIRTY_RENDERING:
+                    board_renderer.invalidate()
+                dirty_rects = board_renderer.draw(screen, grid, notes, selected, error_cells, elapsed_seconds, note_mode, max_mistakes, error_flash, success_flash)
 
                 if not timer_stopped and time.time() - last_interaction_time >= 3600:
-                    print("Inactivity detected for 30 seconds, sending WhatsApp message")
-                    await send_whatsapp_message()
+                    if not message_sent:
+                        print("Inactivity detected for an hour, queueing WhatsApp message")
+                    send_whatsapp_message()
 
                 if game_over:
+                    # The payment page is only needed once the buy screen is shown
+                    await payment_server.start()
+                    # Overlays cover the whole board, so they are flipped and the next frame is redrawn in full
+                    board_renderer.invalidate()
+                    dirty_rects = None
                     overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
                     overlay.fill((0, 0, 0, 180))
                     screen.blit(overlay, (0, 0))
                     pygame.draw.rect(screen, (255, 255, 255), (100, 180, 400, 330), border_radius=10)
                     pygame.draw.rect(screen, (0, 0, 0), (100, 180, 400, 330), 2, border_radius=10)
-                    message = FONT.render("Ai făcut prea multe greșeli!", True, (200, 0, 0))
+                    message = GLYPHS.render(FONT, "Ai făcut prea multe greșeli!", (200, 0, 0))
                     screen.blit(message, (SCREEN_WIDTH // 2 - message.get_width() // 2, 210))
                     if payment_failed:
-                        failed_text = FONT.render("Plata a eșuat. Încearcă din nou.", True, (255, 0, 0))
+                        failed_text = GLYPHS.render(FONT, "Plata a eșuat. Încearcă din nou.", (255, 0, 0))
                         screen.blit(failed_text, (SCREEN_WIDTH // 2 - failed_text.get_width() // 2, 250))
                     pygame.draw.rect(screen, (180, 180, 180), (180, 300, 240, 50), border_radius=8)
-                    back_text = FONT.render("Meniu Principal", True, (0, 0, 0))
+                    back_text = GLYPHS.render(FONT, "Meniu Principal", (0, 0, 0))
                     screen.blit(back_text, (SCREEN_WIDTH // 2 - back_text.get_width() // 2, 310))
                     buy_10_rect = pygame.Rect(120, 370, 360, 50)
                     buy_10_color = (100, 200, 100) if buy_10_rect.collidepoint(pygame.mouse.get_pos()) else (80, 180, 80)
                     pygame.draw.rect(screen, buy_10_color, buy_10_rect, border_radius=8)
-                    buy_10_text = FONT.render("Cumpără 10 Șanse (1 leu)", True, (0, 0, 0))
+                    buy_10_text = GLYPHS.render(FONT, "Cumpără 10 Șanse (1 leu)", (0, 0, 0))
                     screen.blit(buy_10_text, (SCREEN_WIDTH // 2 - buy_10_text.get_width() // 2, 380))
                     buy_25_rect = pygame.Rect(120, 440, 360, 50)
                     buy_25_color = (100, 200, 100) if buy_25_rect.collidepoint(pygame.mouse.get_pos()) else (80, 180, 80)
                     pygame.draw.rect(screen, buy_25_color, buy_25_rect, border_radius=8)
-                    buy_25_text = FONT.render("Cumpără 25 Șanse (2 lei)", True, (0, 0, 0))
+                    buy_25_text = GLYPHS.render(FONT, "Cumpără 25 Șanse (2 lei)", (0, 0, 0))
                     screen.blit(buy_25_text, (SCREEN_WIDTH // 2 - buy_25_text.get_width() // 2, 450))
+                    PROFILER.lap("game_over")
 
-                if check_sudoku(grid, grid_size) and not timer_stopped:
+                if move_made and session.is_solved() and not timer_stopped:
                     if success_sound:
                         success_sound.play()
                     success_flash = True
                     flash_start = time.time()
                     draw_success_message(screen, SCREEN_WIDTH, SCREEN_HEIGHT - HEADER_HEIGHT)
+                    board_renderer.invalidate()
+                    dirty_rects = None
                     timer_stopped = True
+                    record_game(session, elapsed_seconds, "solved")
+                    if session.journal:
+                        session.journal.close(finished=True)
+                        session.journal = None
+                move_made = False
+                PROFILER.lap("check_solved")
 
                 if (error_flash or success_flash) and time.time() - flash_start > 0.5:
                     error_flash = False
                     success_flash = False
 
-                for event in pygame.event.get():
+                events = scheduler.get_events()
+                for event in events:
                     if event.type == pygame.QUIT:
                         print("Quit event detected in main loop")
-                        SERVER_RUNNING.clear()
                         return
                     if event.type in (pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN):
                         last_interaction_time = time.time()
@@ -557,11 +1225,14 @@ async def main():
                             return_to_menu = True
                             break
                         if pygame.Rect(115, 10, 90, 40).collidepoint(mouse_x, mouse_y):
-                            solved_grid = generate_solved_grid(grid_size, box_size)
-                            grid = create_puzzle(solved_grid, num_empty_cells=num_empty)
-                            original_cells = [[cell != 0 for cell in row] for row in grid]
-                            error_cells = [[False for _ in range(grid_size)] for _ in range(grid_size)]
-                            notes = [[set() for _ in range(grid_size)] for _ in range(grid_size)]
+                            new_session = await start_session(dificultate, None, elapsed_seconds)
+                            if new_session is None:
+                                return
+                            session = new_session
+                            show_puzzle_code(dificultate, session.seed)
+                            grid, original_cells, error_cells, notes = session.grid, session.original_cells, session.error_cells, session.notes
+                            board_renderer = BoardRenderer(grid, original_cells, grid_size, box_size, SCREEN_WIDTH, SCREEN_HEIGHT)
+                            move_made = False
                             start_time = time.time()
                             selected = None
                             game_over = False
@@ -575,11 +1246,13 @@ async def main():
                                 break
                             if buy_10_rect.collidepoint(mouse_x, mouse_y):
                                 print("Opening payment page for 10 chances")
-                                webbrowser.open("http://localhost:8000/payment.html?chances=10")
-                                success, additional_chances = await check_payment_confirmation(10, screen, SCREEN_WIDTH, SCREEN_HEIGHT, grid, grid_size, box_size, elapsed_seconds, note_mode, max_mistakes, selected, error_cells, notes, error_flash, success_flash)
+                                token, confirmation = PAYMENTS.open(10)
+                                webbrowser.open(f"http://localhost:{PAYMENT_PORT}/payment.html?chances=10&token={token}")
+                                success, additional_chances = await check_payment_confirmation(token, confirmation, 10, screen, SCREEN_WIDTH, SCREEN_HEIGHT, grid, grid_size, box_size, elapsed_seconds, note_mode, max_mistakes, selected, error_cells, notes, error_flash, success_flash)
                                 if success:
                                     print(f"Adding {additional_chances} chances, previous max_mistakes: {max_mistakes}")
-                                    max_mistakes += additional_chances
+                                    session.add_chances(additional_chances)
+                                    max_mistakes = session.max_mistakes
                                     print(f"New max_mistakes: {max_mistakes}")
                                     game_over = False
                                     timer_stopped = False
@@ -594,11 +1267,13 @@ async def main():
                                 continue
                             if buy_25_rect.collidepoint(mouse_x, mouse_y):
                                 print("Opening payment page for 25 chances")
-                                webbrowser.open("http://localhost:8000/payment.html?chances=25")
-                                success, additional_chances = await check_payment_confirmation(25, screen, SCREEN_WIDTH, SCREEN_HEIGHT, grid, grid_size, box_size, elapsed_seconds, note_mode, max_mistakes, selected, error_cells, notes, error_flash, success_flash)
+                                token, confirmation = PAYMENTS.open(25)
+                                webbrowser.open(f"http://localhost:{PAYMENT_PORT}/payment.html?chances=25&token={token}")
+                                success, additional_chances = await check_payment_confirmation(token, confirmation, 25, screen, SCREEN_WIDTH, SCREEN_HEIGHT, grid, grid_size, box_size, elapsed_seconds, note_mode, max_mistakes, selected, error_cells, notes, error_flash, success_flash)
                                 if success:
                                     print(f"Adding {additional_chances} chances, previous max_mistakes: {max_mistakes}")
-                                    max_mistakes += additional_chances
+                                    session.add_chances(additional_chances)
+                                    max_mistakes = session.max_mistakes
                                     print(f"New max_mistakes: {max_mistakes}")
                                     game_over = False
                                     timer_stopped = False
@@ -612,43 +1287,56 @@ async def main():
                                 message_sent = False
                                 continue
                     if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_n:
+                        # On 25x25 and up N and H are symbols too; Tab, Shift+N and Shift+H always work
+                        typed = key_number(event.key, event.mod, grid_size)
+                        if event.key == pygame.K_n and event.mod & pygame.KMOD_SHIFT:
+                            # Shift+N: fill every empty cell's notes with its candidates
+                            session.auto_notes()
+                        elif event.key == pygame.K_TAB or (event.key == pygame.K_n and typed is None):
                             note_mode = not note_mode
+                        if event.mod & pygame.KMOD_CTRL and event.key in (pygame.K_z, pygame.K_y):
+                            # Ctrl+Z undoes, Ctrl+Y or Ctrl+Shift+Z redoes; a mistake stays counted
+                            if event.key == pygame.K_y or event.mod & pygame.KMOD_SHIFT:
+                                cell = session.redo()
+                            else:
+                                cell = session.undo()
+                            if cell:
+                                selected = cell
+                                move_made = True
+                        if event.key == pygame.K_F3:
+                            show_profile = not show_profile
+                            PROFILER.enabled = PROFILER.enabled or show_profile
+                        if event.key == pygame.K_h and typed is None and not game_over:
+                            hint = session.hint()
+                            if hint:
+                                print(f"Hint: {hint.technique} {hint.num} at {hint.row + 1},{hint.col + 1}")
+                                selected = (hint.row, hint.col)
+                                if hint.technique == "wrong_digit":
+                                    error_flash = True
+                                else:
+                                    success_flash = True
+                                flash_start = time.time()
                         if selected and not game_over:
                             row, col = selected
-                            number = None
-                            if event.key in range(pygame.K_1, pygame.K_9 + 1):
-                                number = event.key - pygame.K_0
-                            elif grid_size == 16 and event.key in [pygame.K_a, pygame.K_b, pygame.K_c, pygame.K_d, pygame.K_e, pygame.K_f, pygame.K_g]:
-                                number = 10 + (event.key - pygame.K_a)
-                            if number and 1 <= number <= grid_size and not original_cells[row][col]:
+                            number = typed
+                            if number and not original_cells[row][col]:
                                 if note_mode:
-                                    if number in notes[row][col]:
-                                        notes[row][col].remove(number)
-                                    else:
-                                        notes[row][col].add(number)
+                                    session.toggle_note(row, col, number)
                                 else:
-                                    grid[row][col] = number
-                                    notes[row][col].clear()
-                                    if is_valid_move(grid, row, col, number, box_size):
-                                        error_cells[row][col] = False
-                                    else:
-                                        error_cells[row][col] = True
+                                    move_made = True
+                                    if session.place(row, col, number) is False:
                                         if error_sound:
                                             error_sound.play()
                                         error_flash = True
                                         flash_start = time.time()
-                                        max_mistakes -= 1
+                                        max_mistakes = session.max_mistakes
                                         print(f"Mistake made, max_mistakes reduced to: {max_mistakes}")
-                                        if max_mistakes <= 0:
+                                        if session.game_over:
                                             game_over = True
                                             timer_stopped = True
                         if event.key == pygame.K_BACKSPACE and selected:
                             row, col = selected
-                            if not original_cells[row][col]:
-                                grid[row][col] = 0
-                                notes[row][col].clear()
-                                error_cells[row][col] = False
+                            session.erase(row, col)
                     if game_over and event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                         x, y = pygame.mouse.get_pos()
                         if pygame.Rect(180, 300, 240, 50).collidepoint(x, y):
@@ -656,11 +1344,29 @@ async def main():
                             break
 
                 if return_to_menu:
+                    if session.journal:
+                        session.journal.close()
                     break
+                PROFILER.lap("events")
 
-                pygame.display.flip()
-                clock.tick(FPS)
-                await asyncio.sleep(1.0 / FPS)
+                if show_profile:
+                    profile_rect = draw_profile_overlay(screen, SCREEN_WIDTH, SCREEN_HEIGHT)
+                    board_renderer.damage(profile_rect)
+                    if dirty_rects is not None:
+                        dirty_rects.append(profile_rect)
+                    PROFILER.lap("profile_overlay")
+                if dirty_rects is None:
+                    pygame.display.flip()
+                elif dirty_rects:
+                    pygame.display.update(dirty_rects)
+                PROFILER.lap("display_update")
+                PROFILER.end_frame()
+                animating = error_flash or success_flash or game_over
+                if timer_stopped:
+                    await scheduler.next_frame(animating or bool(events))
+                else:
+                    await scheduler.next_frame(animating or bool(events), 1.0 - (time.time() - start_time) % 1.0)
+                PROFILER.lap("wait")
 
     setup()
     try:
@@ -668,15 +1374,23 @@ async def main():
     except Exception as e:
         print(f"Unhandled exception in main loop: {e}")
     finally:
-        SERVER_RUNNING.clear()
-        if httpd:
-            httpd.server_close()
-            print("HTTP server closed")
+        if session and session.journal:
+            session.journal.close()
+        puzzle_pool.stop()
+        if stats:
+            stats.stop()
+            print(f"Stats store: {stats.stats()}")
+        print(f"Puzzle pool stats: {puzzle_pool.stats()}")
+        print(f"Puzzle cache stats: {engine.puzzle_cache.stats()}")
+        if engine.library:
+            print(f"Puzzle library stats: {engine.library.stats()}")
+        print(f"Glyph cache stats: {GLYPHS.stats()}")
+        print(f"Scheduler: {scheduler.total_wakeups} wakeups, {scheduler.wakeups_per_second()} in the last second")
+        await payment_server.stop()
+        await notifier.stop()
+        print(f"Notifications: {notifier.stats()}")
+        if PROFILE_FILE and PROFILER.dump(PROFILE_FILE):
+            print(f"Frame profile written to {PROFILE_FILE}")
 
 if __name__ == "__main__":
-    if os.path.exists(PAYMENT_SUCCESS_FILE):
-        try:
-            os.remove(PAYMENT_SUCCESS_FILE)
-        except Exception as e:
-            print(f"Failed to clean up {PAYMENT_SUCCESS_FILE}: {e}")
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,532 @@
+import argparse
+import asyncio
+import functools
+import http.server
+import importlib.util
+import os
+import socketserver
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+GAME_FILE = os.path.join(CURRENT_DIR, "Var final.py")
+
+def load_game_module():
+    spec = importlib.util.spec_from_file_location("sudoku_game", GAME_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class ReusableTCPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+def start_legacy_server(port):
+    # The original payment server: one TCPServer handling one request at a time
+    httpd = ReusableTCPServer(("", port), functools.partial(QuietHandler, directory=CURRENT_DIR))
+    running = threading.Event()
+    running.set()
+
+    def serve():
+        while running.is_set():
+            httpd.handle_request()
+        httpd.server_close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return httpd, running
+
+async def fetch(port, connection, path):
+    reader, writer = connection or await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: keep-alive\r\n\r\n".encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    else:
+        await reader.read()
+    if headers.get("connection", "").lower() == "keep-alive" and b"HTTP/1.1" in status_line:
+        return (reader, writer)
+    writer.close()
+    return None
+
+async def run_load(port, clients, requests_per_client, path="/payment.html"):
+    async def client():
+        connection = None
+        for _ in range(requests_per_client):
+            connection = await fetch(port, connection, path)
+        if connection:
+            connection[1].close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    return clients * requests_per_client / elapsed
+
+def bench_payment_server(args):
+    game = load_game_module()
+    httpd, running = start_legacy_server(args.port + 1)
+    legacy_rps = asyncio.run(run_load(args.port + 1, args.clients, args.requests))
+    running.clear()
+
+    async def run_new():
+        server = game.PaymentServer(port=args.port)
+        await server.start()
+        try:
+            return await run_load(args.port, args.clients, args.requests)
+        finally:
+            await server.stop()
+
+    new_rps = asyncio.run(run_new())
+    print(f"payment server, {args.clients} clients x {args.requests} requests")
+    print(f"  legacy TCPServer: {legacy_rps:8.0f} req/s")
+    print(f"  asyncio server:   {new_rps:8.0f} req/s")
+
+STARTUP_PROBE = """
+import asyncio, importlib.util, os, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("sudoku_game", sys.argv[1])
+game = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(game)
+imported = time.perf_counter()
+import pygame
+def first_flip(*args):
+    print(imported - start, time.perf_counter() - start)
+    sys.stdout.flush()
+    os._exit(0)
+pygame.display.flip = first_flip
+asyncio.run(game.main())
+"""
+
+def bench_startup(args):
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy", PYGAME_HIDE_SUPPORT_PROMPT="1")
+    imports, first_frames = [], []
+    for _ in range(args.runs):
+        result = subprocess.run([sys.executable, "-c", STARTUP_PROBE, args.game_file], env=env, capture_output=True, text=True, cwd=CURRENT_DIR)
+        import_time, first_frame = map(float, result.stdout.split()[-2:])
+        imports.append(import_time)
+        first_frames.append(first_frame)
+    print(f"startup of {os.path.basename(args.game_file)}, median of {args.runs} runs")
+    print(f"  import:            {statistics.median(imports) * 1000:7.1f} ms")
+    print(f"  first menu frame:  {statistics.median(first_frames) * 1000:7.1f} ms")
+
+def legacy_state(puzzle):
+    # Per-game state as GameSession kept it before Board: lists of lists and a set per cell
+    n = len(puzzle)
+    return ([row[:] for row in puzzle], [[cell != 0 for cell in row] for row in puzzle],
+            [[False] * n for _ in range(n)], [[set() for _ in range(n)] for _ in range(n)])
+
+def copy_legacy_state(state):
+    grid, givens, errors, notes = state
+    return ([row[:] for row in grid], [row[:] for row in givens], [row[:] for row in errors],
+            [[set(cell) for cell in row] for row in notes])
+
+def measure_memory(build, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build() for _ in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used / count
+
+def measure_copy(copy, state, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        copy(state)
+    return (time.perf_counter() - start) / count
+
+def bench_board(args):
+    import sudoku_engine
+    print(f"board state, {args.boards} boards for memory, {args.copies} copies for timing")
+    for grid_size, box_size in ((9, 3), (16, 4)):
+        puzzle = sudoku_engine.create_puzzle(sudoku_engine.generate_solved_grid(grid_size, box_size), grid_size * grid_size // 2)
+        legacy = legacy_state(puzzle)
+        board = sudoku_engine.Board.from_grid(puzzle, box_size)
+        for row in range(grid_size):
+            for col in range(0, grid_size, 3):
+                if not puzzle[row][col]:
+                    legacy[3][row][col].update((1, 2))
+                    board.toggle_note(row, col, 1)
+                    board.toggle_note(row, col, 2)
+        legacy_memory = measure_memory(lambda: copy_legacy_state(legacy), args.boards)
+        board_memory = measure_memory(board.copy, args.boards)
+        legacy_copy = measure_copy(copy_legacy_state, legacy, args.copies)
+        board_copy = measure_copy(sudoku_engine.Board.copy, board, args.copies)
+        snapshot = measure_copy(sudoku_engine.Board.snapshot, board, args.copies)
+        label = f"{grid_size}x{grid_size}"
+        print(f"  {label:>5} lists and sets: {legacy_memory / 1024:7.1f} KiB, copy {legacy_copy * 1e6:7.1f} us")
+        print(f"  {label:>5} Board:          {board_memory / 1024:7.1f} KiB, copy {board_copy * 1e6:7.1f} us, snapshot {snapshot * 1e6:5.1f} us")
+
+def validation_boards(grid_size, count):
+    # Solved boards with a share of them broken: a swapped cell, a blank or a copied row
+    import random
+    import sudoku_engine
+    box_size = int(round(grid_size ** 0.5))
+    seeds = [sudoku_engine.generate_solved_grid(grid_size, box_size) for _ in range(20)]
+    boards = []
+    for i in range(count):
+        board = [row[:] for row in seeds[i % len(seeds)]]
+        damage = random.random()
+        row, col = random.randrange(grid_size), random.randrange(grid_size)
+        if damage < 0.2:
+            board[row][col] = random.randint(1, grid_size)
+        elif damage < 0.3:
+            board[row][col] = 0
+        elif damage < 0.35:
+            board[row] = board[(row + 1) % grid_size][:]
+        boards.append(board)
+    return boards
+
+def bench_validate(args):
+    import numpy as np
+    import sudoku_engine
+    print(f"board validation, {args.boards} boards per size")
+    for grid_size in (9, 16):
+        boards = validation_boards(grid_size, args.boards)
+        array = np.array(boards, dtype=np.int8)
+        start = time.perf_counter()
+        scalar = [sudoku_engine.check_sudoku(board, grid_size) for board in boards]
+        scalar_time = time.perf_counter() - start
+        start = time.perf_counter()
+        vectorized = sudoku_engine.check_sudoku_batch(array)
+        vector_time = time.perf_counter() - start
+        assert vectorized.tolist() == scalar, "check_sudoku_batch disagrees with check_sudoku"
+        label = f"{grid_size}x{grid_size}"
+        print(f"  {label:>5} check_sudoku:       {args.boards / scalar_time:10.0f} boards/s ({sum(scalar)} valid)")
+        print(f"  {label:>5} check_sudoku_batch: {args.boards / vector_time:10.0f} boards/s, {scalar_time / vector_time:.0f}x")
+
+def bench_sizes(args):
+    # Generation time per board size, then full and idle (dirty) frame times of the
+    # renderer on a headless display
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    import sudoku_engine
+    game = load_game_module()
+    game.init_display()
+    pygame = game.pygame
+    screen = pygame.display.set_mode((600, 660))
+    print(f"board sizes, {args.puzzles} puzzles and {args.frames} frames per size")
+    for dificultate in ("mediu", "4x4", "5x5", "6x6"):
+        grid_size, box_size, _ = sudoku_engine.difficulty_settings(dificultate)
+        times = []
+        for _ in range(args.puzzles):
+            start = time.perf_counter()
+            solution, puzzle = sudoku_engine.generate_puzzle(dificultate)
+            times.append(time.perf_counter() - start)
+        session = sudoku_engine.GameSession(puzzle, solution)
+        session.auto_notes()
+        renderer = game.BoardRenderer(session.grid, grid_size, box_size, 600, 660)
+
+        def frame():
+            renderer.draw(screen, session.grid, session.notes, (0, 0), session.error_cells, 0, False, 3)
+
+        frame()
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            renderer.invalidate()
+            frame()
+        full_frame = (time.perf_counter() - start) / args.frames
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            frame()
+        idle_frame = (time.perf_counter() - start) / args.frames
+        label = f"{grid_size}x{grid_size}"
+        print(f"  {label:>5} generate {statistics.median(times) * 1000:7.1f} ms median, {max(times) * 1000:7.1f} ms max;"
+              f" full frame {full_frame * 1000:5.2f} ms, idle frame {idle_frame * 1000:5.2f} ms")
+
+def bench_derive(args):
+    import sudoku_engine
+    library = sudoku_engine.SeedLibrary(args.seeds)
+    print(f"puzzles per second, full generation ({args.generated} puzzles) against derivation ({args.derived} puzzles)")
+    for dificultate in ("usor", "mediu", "greu", "4x4", "5x5", "6x6"):
+        start = time.perf_counter()
+        for _ in range(args.generated):
+            sudoku_engine.generate_puzzle(dificultate)
+        generated = args.generated / (time.perf_counter() - start)
+        for _ in range(args.seeds):
+            library.puzzles[dificultate].append(library.generate(dificultate))
+        start = time.perf_counter()
+        for _ in range(args.derived):
+            library.take(dificultate)
+        derived = args.derived / (time.perf_counter() - start)
+        print(f"  {dificultate:>5}: generate {generated:8.1f}/s, derive {derived:8.0f}/s, {derived / generated:6.0f}x")
+
+def bench_profiler(args):
+    # Idle and full frame times with the stage profiler off and on; best of several
+    # rounds, alternating, so both see the same machine state
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    import sudoku_engine
+    from stage_profiler import PROFILER
+    game = load_game_module()
+    game.init_display()
+    screen = game.pygame.display.set_mode((600, 660))
+    print(f"stage profiler overhead, best of {args.rounds} rounds of {args.frames} frames")
+    for enabled in (False, True):
+        PROFILER.enabled = enabled
+        PROFILER.begin_frame()
+        start = time.perf_counter()
+        for _ in range(100000):
+            PROFILER.lap("lap")
+        print(f"  one lap, profiler {'on' if enabled else 'off'}: {(time.perf_counter() - start) * 10:.3f} us")
+    for dificultate in ("mediu", "6x6"):
+        grid_size, box_size, _ = sudoku_engine.difficulty_settings(dificultate)
+        solution, puzzle = sudoku_engine.generate_puzzle(dificultate)
+        session = sudoku_engine.GameSession(puzzle, solution)
+        session.auto_notes()
+        renderer = game.BoardRenderer(session.grid, grid_size, box_size, 600, 660)
+
+        def frames(full):
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                PROFILER.begin_frame()
+                if full:
+                    renderer.invalidate()
+                renderer.draw(screen, session.grid, session.notes, (0, 0), session.error_cells, 0, False, 3)
+                PROFILER.end_frame()
+            return (time.perf_counter() - start) / args.frames
+
+        frames(True)
+        results = {}
+        for round_index in range(args.rounds):
+            for enabled in ((False, True) if round_index % 2 else (True, False)):
+                PROFILER.enabled = enabled
+                for full in (False, True):
+                    key = (enabled, full)
+                    results[key] = min(results.get(key, float("inf")), frames(full))
+        PROFILER.enabled = False
+        for full, label in ((False, "idle"), (True, "full")):
+            off, on = results[(False, full)], results[(True, full)]
+            print(f"  {grid_size:>2}x{grid_size:<2} {label} frame: off {off * 1000:6.3f} ms, on {on * 1000:6.3f} ms ({(on - off) * 1e6:+5.1f} us)")
+
+def bench_library(args):
+    # Opening a library and drawing a puzzle from it, for libraries of growing size
+    import random
+    import tempfile
+    import puzzle_library
+    directory = tempfile.mkdtemp()
+    print(f"puzzle library, 9x9 and 16x16 records derived from {args.derive} puzzles per difficulty")
+    for count in args.counts:
+        path = os.path.join(directory, f"{count}.lib")
+        start = time.perf_counter()
+        puzzle_library.build_library(path, {"mediu": count, "4x4": count}, derive=args.derive, progress=None)
+        built = time.perf_counter() - start
+        opens = []
+        for _ in range(args.lookups // 10):
+            start = time.perf_counter()
+            puzzle_library.PuzzleLibrary(path).close()
+            opens.append(time.perf_counter() - start)
+        library = puzzle_library.PuzzleLibrary(path)
+        rng = random.Random(1)
+        lookups = {}
+        for dificultate in ("mediu", "4x4"):
+            times = []
+            for _ in range(args.lookups):
+                start = time.perf_counter()
+                library.random(dificultate, rng)
+                times.append(time.perf_counter() - start)
+            lookups[dificultate] = statistics.median(times)
+        library.close()
+        print(f"  {count:>8} records per difficulty, {os.path.getsize(path) / 2 ** 20:7.1f} MiB, built in {built:6.1f} s"
+              f" ({2 * count / built:.0f}/s): open {statistics.median(opens) * 1e6:5.0f} us,"
+              f" lookup 9x9 {lookups['mediu'] * 1e6:4.0f} us, 16x16 {lookups['4x4'] * 1e6:4.0f} us")
+        os.remove(path)
+
+def bench_grade(args):
+    # Grading throughput on carved 9x9 and 16x16 candidates, in process and across
+    # worker processes, then what the technique bands cost per generated puzzle
+    import collections
+    import concurrent.futures
+    import random
+    import sudoku_engine
+    print(f"technique grader, {args.puzzles} candidates per size")
+    for grid_size, box_size, blanks in ((9, 3, 64), (16, 4, 150)):
+        rng = random.Random(1)
+        puzzles = []
+        for _ in range(args.puzzles):
+            solution = sudoku_engine.generate_solved_grid(grid_size, box_size, rng)
+            puzzles.append(sudoku_engine.create_puzzle(solution, blanks, None, rng))
+        start = time.perf_counter()
+        grades = [sudoku_engine.grade_puzzle(puzzle) for puzzle in puzzles]
+        serial = len(puzzles) / (time.perf_counter() - start)
+        with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+            list(pool.map(sudoku_engine.grade_puzzle, puzzles[:args.workers]))
+            start = time.perf_counter()
+            list(pool.map(sudoku_engine.grade_puzzle, puzzles, chunksize=8))
+            parallel = len(puzzles) / (time.perf_counter() - start)
+        hardest = collections.Counter(grade.hardest for grade in grades)
+        print(f"  {grid_size:>2}x{grid_size:<2} {serial:6.0f}/s in process, {parallel:6.0f}/s on {args.workers} workers;"
+              f" hardest: " + ", ".join(f"{name} {count}" for name, count in hardest.most_common()))
+    for dificultate in sudoku_engine.TECHNIQUE_BANDS:
+        times = []
+        hardest = collections.Counter()
+        for _ in range(args.bands):
+            start = time.perf_counter()
+            _, puzzle = sudoku_engine.seeded_puzzle(sudoku_engine.new_seed(), dificultate)
+            times.append(time.perf_counter() - start)
+            hardest[sudoku_engine.grade_puzzle(puzzle).hardest] += 1
+        print(f"  {dificultate:>5} band {sudoku_engine.TECHNIQUE_BANDS[dificultate]}: generate {statistics.median(times) * 1000:6.1f} ms median,"
+              f" {max(times) * 1000:6.1f} ms max; hardest: " + ", ".join(f"{name} {count}" for name, count in hardest.most_common()))
+
+def time_stats_screen(store, levels, runs):
+    # Median time to read everything the stats screen shows: six summaries and a leaderboard
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for grid_size, dificultate in levels:
+            store.summary(grid_size, dificultate)
+        store.best_times(*levels[0], 5)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def bench_stats(args):
+    # Recording cost on the game's side, write-behind throughput, and stats screen queries
+    # with and without the indexes
+    import random
+    import tempfile
+    import stats_store
+    import sudoku_engine
+    path = os.path.join(tempfile.mkdtemp(), "stats.sqlite3")
+    levels = [(sudoku_engine.difficulty_settings(dificultate)[0], dificultate)
+              for dificultate in list(sudoku_engine.DIFFICULTIES) + list(sudoku_engine.BOX_DIFFICULTIES)]
+    rng = random.Random(1)
+    store = stats_store.StatsStore(path)
+    store.start()
+    print(f"stats store, {args.games} games over {len(levels)} levels")
+    finished_at = time.time() - args.games * 60
+    times = []
+    start = time.perf_counter()
+    for game in range(args.games):
+        grid_size, dificultate = rng.choice(levels)
+        result = rng.choices(("solved", "lost", "abandoned"), (8, 1, 1))[0]
+        record_start = time.perf_counter()
+        store.record(grid_size, dificultate, None, rng.randint(60, 3600), rng.randint(0, 3), 0, result, finished_at + game * 60)
+        times.append(time.perf_counter() - record_start)
+    store.flush(timeout=None)
+    written = time.perf_counter() - start
+    times.sort()
+    print(f"  record {times[len(times) // 2] * 1e6:.1f} us median, {times[len(times) * 99 // 100] * 1e6:.1f} us p99, {times[-1] * 1e3:.2f} ms max;"
+          f" {args.games / written:.0f} games/s written in {store.batches} batches, {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+    indexed = time_stats_screen(store, levels, args.runs)
+    print(f"  stats screen {indexed * 1e3:7.2f} ms with the indexes", end="")
+    store.query("DROP INDEX games_by_board")
+    store.query("DROP INDEX games_by_time")
+    print(f", {time_stats_screen(store, levels, args.runs) * 1e3:7.2f} ms without")
+    store.stop()
+    os.remove(path)
+
+def play_journaled(sudoku_engine, dificultate, moves, path):
+    import random
+    rng = random.Random(1)
+    solution, puzzle = sudoku_engine.generate_puzzle(dificultate, rng=random.Random(1))
+    session = sudoku_engine.GameSession(puzzle, solution, max_mistakes=10 ** 6)
+    session.start_journal(path, dificultate)
+    grid_size = session.grid_size
+    times = []
+    for move in range(moves):
+        row, col, num = rng.randrange(grid_size), rng.randrange(grid_size), rng.randint(1, grid_size)
+        action = rng.choice((session.place, session.toggle_note, session.undo, session.redo))
+        start = time.perf_counter()
+        if action in (session.undo, session.redo):
+            action()
+        else:
+            action(row, col, num)
+        session.journal.maybe_flush(move)
+        times.append(time.perf_counter() - start)
+    session.journal.close()
+    return times
+
+def bench_journal(args):
+    import tempfile
+    import sudoku_engine
+    path = os.path.join(tempfile.mkdtemp(), "journal.jsonl")
+    print(f"move journal, {args.moves} random moves, undos and redos per game")
+    snapshot_every = sudoku_engine.JOURNAL_SNAPSHOT_MOVES
+    for dificultate in ("mediu", "4x4", "6x6"):
+        results = []
+        # With and without snapshots, i.e. replaying only the tail against the whole journal
+        for snapshot_moves in (snapshot_every, 10 ** 9):
+            sudoku_engine.JOURNAL_SNAPSHOT_MOVES = snapshot_moves
+            times = play_journaled(sudoku_engine, dificultate, args.moves, path)
+            start = time.perf_counter()
+            for _ in range(args.resumes):
+                session, _, _ = sudoku_engine.resume_session(path)
+                session.journal.close()
+            results.append((statistics.median(times), max(times), (time.perf_counter() - start) / args.resumes, os.path.getsize(path)))
+        sudoku_engine.JOURNAL_SNAPSHOT_MOVES = snapshot_every
+        (median, worst, resume, size), (_, _, full_replay, _) = results
+        print(f"  {dificultate:>5}: move {median * 1e6:6.1f} us median, {worst * 1e3:5.2f} ms max (fsync)"
+              f" | resume {resume * 1e3:6.2f} ms, replaying the whole journal {full_replay * 1e3:7.2f} ms | {size / 1024:.0f} KiB")
+    os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Sudoku performance benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    server_parser = subparsers.add_parser("payment-server", help="requests per second of the payment server")
+    server_parser.add_argument("--port", type=int, default=8100)
+    server_parser.add_argument("--clients", type=int, default=20)
+    server_parser.add_argument("--requests", type=int, default=50)
+    server_parser.set_defaults(func=bench_payment_server)
+    startup_parser = subparsers.add_parser("startup", help="import time and time to the first menu frame")
+    startup_parser.add_argument("--runs", type=int, default=5)
+    startup_parser.add_argument("--game-file", default=GAME_FILE)
+    startup_parser.set_defaults(func=bench_startup)
+    board_parser = subparsers.add_parser("board", help="memory and copy cost of the per-game board state")
+    board_parser.add_argument("--boards", type=int, default=1000)
+    board_parser.add_argument("--copies", type=int, default=10000)
+    board_parser.set_defaults(func=bench_board)
+    validate_parser = subparsers.add_parser("validate", help="scalar check_sudoku against the numpy batch validator")
+    validate_parser.add_argument("--boards", type=int, default=50000)
+    validate_parser.set_defaults(func=bench_validate)
+    sizes_parser = subparsers.add_parser("sizes", help="generation and frame times from 9x9 up to 36x36")
+    sizes_parser.add_argument("--puzzles", type=int, default=10)
+    sizes_parser.add_argument("--frames", type=int, default=50)
+    sizes_parser.set_defaults(func=bench_sizes)
+    derive_parser = subparsers.add_parser("derive", help="full generation against seed derivation, in puzzles per second")
+    derive_parser.add_argument("--generated", type=int, default=5)
+    derive_parser.add_argument("--derived", type=int, default=1000)
+    derive_parser.add_argument("--seeds", type=int, default=2)
+    derive_parser.set_defaults(func=bench_derive)
+    journal_parser = subparsers.add_parser("journal", help="cost of a journaled move and of resuming a saved game")
+    journal_parser.add_argument("--moves", type=int, default=5000)
+    journal_parser.add_argument("--resumes", type=int, default=20)
+    journal_parser.set_defaults(func=bench_journal)
+    profiler_parser = subparsers.add_parser("profiler", help="frame time with the stage profiler off and on")
+    profiler_parser.add_argument("--frames", type=int, default=200)
+    profiler_parser.add_argument("--rounds", type=int, default=5)
+    profiler_parser.set_defaults(func=bench_profiler)
+    library_parser = subparsers.add_parser("library", help="open and lookup cost of puzzle libraries of growing size")
+    library_parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000, 100000])
+    library_parser.add_argument("--derive", type=int, default=8)
+    library_parser.add_argument("--lookups", type=int, default=2000)
+    library_parser.set_defaults(func=bench_library)
+    grade_parser = subparsers.add_parser("grade", help="technique grader throughput and score band generation cost")
+    grade_parser.add_argument("--puzzles", type=int, default=200)
+    grade_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    grade_parser.add_argument("--bands", type=int, default=20, help="puzzles generated per band")
+    grade_parser.set_defaults(func=bench_grade)
+    stats_parser = subparsers.add_parser("stats", help="game result recording and stats screen query cost")
+    stats_parser.add_argument("--games", type=int, default=300000)
+    stats_parser.add_argument("--runs", type=int, default=20)
+    stats_parser.set_defaults(func=bench_stats)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import argparse
+import collections
+import concurrent.futures
+import functools
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+
+from sudoku_engine import BOX_DIFFICULTIES, DIFFICULTIES, apply_symmetry, difficulty_settings, new_seed, random_symmetry, seed_rng, seeded_puzzle
+
+# Binary puzzle library: a fixed header with an index of sections, one section per
+# (grid size, difficulty), each a run of fixed-size records. The game maps the file and
+# reads one record per game, so opening it and picking a puzzle cost the same whatever
+# the file holds.
+#
+#   python puzzle_library.py build puzzles.lib --count 100000 --derive 64
+#   python puzzle_library.py info puzzles.lib
+#   SUDOKU_PUZZLE_LIBRARY=puzzles.lib python "Var final.py"
+#
+# Layout, little-endian:
+#   header   magic, version, section count                          (HEADER)
+#   index    MAX_SECTIONS slots: grid size, difficulty, record size,
+#            offset of the first record, record count               (SECTION)
+#   records  from RECORDS_OFFSET on; each is seed base, seed variant, flags, difficulty
+#            code (RECORD), the solution with one digit - 1 per nibble (per byte above
+#            16x16), then one bit per cell marking the givens
+# A record's seed rebuilds the same puzzle with seeded_puzzle, so puzzle codes work for
+# library puzzles too.
+
+MAGIC = b"SUDOKLIB"
+# 2: 9x9 seeds are graded into score bands, so version 1 seeds rebuild other puzzles
+# 3: grids are filled without propagation and 9x9 seeds are banded by technique
+VERSION = 3
+HEADER = struct.Struct("<8sHH")
+SECTION = struct.Struct("<B7sHQQ")
+RECORD = struct.Struct("<IIBB")
+MAX_SECTIONS = 16
+RECORDS_OFFSET = 512
+# Record flag: the seed has a "~variant" part
+DERIVED = 1
+DIFFICULTY_CODES = list(DIFFICULTIES) + list(BOX_DIFFICULTIES)
+# Library the game picks puzzles from when it has the chosen difficulty ('' disables it)
+PUZZLE_LIBRARY_FILE = os.getenv('SUDOKU_PUZZLE_LIBRARY', '')
+# Seeds handed to a builder worker at a time
+BUILD_CHUNK_SIZE = 256
+
+def cell_bytes(grid_size):
+    return (grid_size * grid_size + 1) // 2 if grid_size <= 16 else grid_size * grid_size
+
+def record_size(grid_size):
+    return RECORD.size + cell_bytes(grid_size) + (grid_size * grid_size + 7) // 8
+
+def pack_record(dificultate, seed, solution, puzzle):
+    base, _, variant = seed.partition("~")
+    grid_size = len(solution)
+    digits = [num - 1 for row in solution for num in row]
+    if grid_size <= 16:
+        digits.append(0)
+        cells = bytes(digits[index] << 4 | digits[index + 1] for index in range(0, grid_size * grid_size, 2))
+    else:
+        cells = bytes(digits)
+    # Cell 0 is the lowest bit
+    givens = int("".join("1" if num else "0" for row in reversed(puzzle) for num in reversed(row)), 2)
+    return (RECORD.pack(int(base, 16), int(variant or "0", 16), DERIVED if variant else 0, DIFFICULTY_CODES.index(dificultate))
+            + cells + givens.to_bytes((grid_size * grid_size + 7) // 8, "little"))
+
+def unpack_record(data, offset, grid_size):
+    # (solution, puzzle, seed) from the record at offset
+    base, variant, flags, _ = RECORD.unpack_from(data, offset)
+    offset += RECORD.size
+    count = grid_size * grid_size
+    cells = data[offset:offset + cell_bytes(grid_size)]
+    if grid_size <= 16:
+        digits = [digit for byte in cells for digit in (byte >> 4, byte & 15)]
+    else:
+        digits = list(cells)
+    offset += len(cells)
+    givens = int.from_bytes(data[offset:offset + (count + 7) // 8], "little")
+    solution = [[digit + 1 for digit in digits[row * grid_size:(row + 1) * grid_size]] for row in range(grid_size)]
+    puzzle = [[num if givens >> (row * grid_size + col) & 1 else 0 for col, num in enumerate(solution[row])]
+              for row in range(grid_size)]
+    seed = format(base, "08x") + ("~" + format(variant, "08x") if flags & DERIVED else "")
+    return solution, puzzle, seed
+
+class PuzzleLibrary:
+    # Read side: maps the file and parses only the header, so opening costs the same for
+    # a thousand records or ten million, and random() reads a single record.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, section_count = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} puzzle library")
+            self.sections = {}
+            for index in range(section_count):
+                grid_size, dificultate, size, offset, count = SECTION.unpack_from(self.map, HEADER.size + index * SECTION.size)
+                if offset + size * count > len(self.map):
+                    raise ValueError(f"{path} is truncated")
+                self.sections[(grid_size, dificultate.rstrip(b"\0").decode("ascii"))] = (size, offset, count)
+        except Exception:
+            self.file.close()
+            raise
+        self.lookups = 0
+
+    def count(self, dificultate):
+        section = self.sections.get((difficulty_settings(dificultate)[0], dificultate))
+        return section[2] if section else 0
+
+    def get(self, dificultate, index):
+        grid_size = difficulty_settings(dificultate)[0]
+        size, offset, count = self.sections[(grid_size, dificultate)]
+        if not 0 <= index < count:
+            raise IndexError(index)
+        self.lookups += 1
+        return unpack_record(self.map, offset + index * size, grid_size)
+
+    def random(self, dificultate, rng=random):
+        return self.get(dificultate, rng.randrange(self.count(dificultate)))
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def stats(self):
+        return {"records": {dificultate: count for (_, dificultate), (_, _, count) in self.sections.items()}, "lookups": self.lookups}
+
+def open_library(path=PUZZLE_LIBRARY_FILE):
+    if not path:
+        return None
+    try:
+        return PuzzleLibrary(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Puzzle library not opened: {e}")
+        return None
+
+@functools.lru_cache(maxsize=256)
+def base_puzzle(seed, dificultate):
+    # A worker derives many records from each base, so each one is generated once
+    return seeded_puzzle(seed, dificultate)
+
+def build_chunk(dificultate, seeds):
+    # Runs in a worker; returns the packed records of seeds, in order
+    grid_size, box_size, _ = difficulty_settings(dificultate)
+    records = []
+    for seed in seeds:
+        base, _, variant = seed.partition("~")
+        if not variant:
+            solution, puzzle = seeded_puzzle(seed, dificultate)
+        else:
+            solution, puzzle = base_puzzle(base, dificultate)
+            # The same symmetry seeded_puzzle applies to "base~variant"
+            symmetry = random_symmetry(grid_size, box_size, seed_rng(variant, dificultate))
+            solution, puzzle = apply_symmetry(solution, symmetry), apply_symmetry(puzzle, symmetry)
+        records.append(pack_record(dificultate, seed, solution, puzzle))
+    return b"".join(records)
+
+def library_seeds(count, derive):
+    # Fresh seeds, or with derive "base~variant" seeds over that many bases
+    bases = [new_seed() for _ in range(derive)]
+    for _ in range(count):
+        yield f"{random.choice(bases)}~{new_seed()}" if derive else new_seed()
+
+def build_library(path, counts, workers=None, derive=0, chunk_size=BUILD_CHUNK_SIZE, progress=sys.stderr):
+    # Streams records from worker processes straight to disk, one section per difficulty,
+    # with at most two chunks per worker in flight; the header is written last and the
+    # file renamed into place, so a reader never sees a half-built library.
+    if len(counts) > MAX_SECTIONS:
+        raise ValueError(f"at most {MAX_SECTIONS} sections")
+    workers = workers or os.cpu_count() or 1
+    temp_path = path + ".tmp"
+    sections = []
+    start = time.perf_counter()
+    with open(temp_path, "wb") as f, concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        f.write(bytes(RECORDS_OFFSET))
+        for dificultate, count in counts.items():
+            grid_size = difficulty_settings(dificultate)[0]
+            offset = f.tell()
+            seeds = library_seeds(count, derive)
+            pending = collections.deque()
+            written = 0
+            while True:
+                while len(pending) < workers * 2:
+                    chunk = [seed for _, seed in zip(range(chunk_size), seeds)]
+                    if not chunk:
+                        break
+                    pending.append(pool.submit(build_chunk, dificultate, chunk))
+                if not pending:
+                    break
+                f.write(pending.popleft().result())
+                written = (f.tell() - offset) // record_size(grid_size)
+                if progress:
+                    rate = written / (time.perf_counter() - start)
+                    progress.write(f"\r{dificultate}: {written}/{count} records, {rate:.0f}/s")
+                    progress.flush()
+            if progress:
+                progress.write("\n")
+            sections.append((grid_size, dificultate, offset, written))
+            start = time.perf_counter()
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(sections)))
+        for grid_size, dificultate, offset, count in sections:
+            f.write(SECTION.pack(grid_size, dificultate.encode("ascii"), record_size(grid_size), offset, count))
+    os.replace(temp_path, path)
+    return sections
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect a binary puzzle library")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="generate puzzles into a library file")
+    build_parser.add_argument("path")
+    build_parser.add_argument("--count", type=int, default=10000, help="records per difficulty")
+    build_parser.add_argument("--difficulties", nargs="+", default=["usor", "mediu", "greu", "4x4"], choices=DIFFICULTY_CODES)
+    build_parser.add_argument("--derive", type=int, default=0,
+                              help="derive records from this many generated puzzles per difficulty (0 generates every record)")
+    build_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    info_parser = subparsers.add_parser("info", help="list the sections of a library file")
+    info_parser.add_argument("path")
+    args = parser.parse_args()
+    if args.command == "build":
+        build_library(args.path, {dificultate: args.count for dificultate in args.difficulties}, args.workers, args.derive)
+    library = PuzzleLibrary(args.path)
+    for (grid_size, dificultate), (size, offset, count) in library.sections.items():
+        print(f"{dificultate:>5}  {grid_size}x{grid_size}  {count} records of {size} bytes at {offset}")
+    library.close()
+
+if __name__ == "__main__":
+    main()
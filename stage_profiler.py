@@ -0,0 +1,182 @@
+import csv
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+# Timing of frame stages and puzzle generation, kept in rolling histograms. Nothing here
+# depends on pygame; "Var final.py" draws the overlay and sudoku_engine times generation.
+#
+#   SUDOKU_PROFILE=1 python "Var final.py"                   record from the start (F3 shows it)
+#   SUDOKU_PROFILE_FILE=frames.csv python "Var final.py"     also dump on exit (.json or .csv)
+
+# Samples each stage keeps for its rolling percentiles (about ten seconds of frames at 60 FPS)
+PROFILE_WINDOW = 600
+# Histogram buckets: BUCKETS_PER_DECADE per factor of ten from MIN_SECONDS up to ten seconds
+MIN_SECONDS = 1e-6
+BUCKETS_PER_DECADE = 20
+BUCKETS = 7 * BUCKETS_PER_DECADE + 1
+# Record from startup; otherwise recording starts the first time F3 shows the overlay
+PROFILE = os.getenv('SUDOKU_PROFILE', '0') != '0'
+# File the histograms are written to on exit ('' writes nothing)
+PROFILE_FILE = os.getenv('SUDOKU_PROFILE_FILE', '')
+
+def bucket_index(seconds):
+    if seconds <= MIN_SECONDS:
+        return 0
+    return min(int(math.log10(seconds / MIN_SECONDS) * BUCKETS_PER_DECADE) + 1, BUCKETS - 1)
+
+def bucket_limit(bucket):
+    # Upper edge of a bucket in seconds; percentiles are reported as this edge, so they
+    # are at most one bucket (about 12%) high
+    return MIN_SECONDS * 10 ** (bucket / BUCKETS_PER_DECADE)
+
+class RollingHistogram:
+    # Durations counted per log-spaced bucket, both over the last `window` samples and
+    # over the whole run. Adding a sample is O(1): the bucket of the sample falling out
+    # of the window is kept in a ring and decremented.
+    def __init__(self, window=PROFILE_WINDOW):
+        self.window = window
+        self.ring = bytearray(window)
+        self.position = 0
+        self.size = 0
+        self.recent = [0] * BUCKETS
+        self.totals = [0] * BUCKETS
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds):
+        bucket = bucket_index(seconds)
+        if self.size == self.window:
+            self.recent[self.ring[self.position]] -= 1
+        else:
+            self.size += 1
+        self.ring[self.position] = bucket
+        self.position = (self.position + 1) % self.window
+        self.recent[bucket] += 1
+        self.totals[bucket] += 1
+        self.count += 1
+        self.total_seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def percentile(self, fraction, whole_run=False):
+        counts = self.totals if whole_run else self.recent
+        target = fraction * sum(counts)
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if count and seen >= target:
+                return min(bucket_limit(bucket), self.max_seconds)
+        return 0.0
+
+    def summary(self, whole_run=True):
+        return {"count": self.count if whole_run else self.size,
+                "mean_ms": round(self.total_seconds / self.count * 1000, 4) if self.count else 0.0,
+                "p50_ms": round(self.percentile(0.50, whole_run) * 1000, 4),
+                "p95_ms": round(self.percentile(0.95, whole_run) * 1000, 4),
+                "p99_ms": round(self.percentile(0.99, whole_run) * 1000, 4),
+                "max_ms": round(self.max_seconds * 1000, 4)}
+
+class StageProfiler:
+    # Named RollingHistograms. A frame is timed as laps: begin_frame(), then lap(stage)
+    # after each stage, then end_frame() for the frame as a whole. timed() wraps a
+    # function. While disabled every call returns after one attribute check. Generation
+    # records from the pool thread and executor callbacks too, so the histograms are only
+    # touched under a lock.
+    def __init__(self, enabled=PROFILE, window=PROFILE_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self.stages = {}
+        self.frame_start = 0.0
+        self.last = 0.0
+        self.lock = threading.Lock()
+        # (stage, seconds) of every record while collect() runs
+        self.samples = None
+
+    def record(self, stage, seconds):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = RollingHistogram(self.window)
+            histogram.add(seconds)
+            if self.samples is not None:
+                self.samples.append((stage, seconds))
+
+    def collect(self, func, *args):
+        # For worker processes, whose profiler is not the game's: runs func recording and
+        # returns (result, samples); the game passes the samples to merge()
+        enabled = self.enabled
+        self.enabled = True
+        self.samples = []
+        try:
+            return func(*args), self.samples
+        finally:
+            self.enabled = enabled
+            self.samples = None
+
+    def merge(self, samples):
+        if self.enabled:
+            for stage, seconds in samples:
+                self.record(stage, seconds)
+
+    def begin_frame(self):
+        if self.enabled:
+            self.frame_start = self.last = time.perf_counter()
+
+    def lap(self, stage):
+        if self.enabled and self.last:
+            now = time.perf_counter()
+            self.record(stage, now - self.last)
+            self.last = now
+
+    def end_frame(self):
+        if self.enabled and self.frame_start:
+            now = time.perf_counter()
+            self.record("frame", now - self.frame_start)
+            self.last = now
+
+    def timed(self, stage):
+        def decorate(func):
+            @functools.wraps(func)
+            def timed_call(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+            return timed_call
+        return decorate
+
+    def summary(self, whole_run=True):
+        with self.lock:
+            return {stage: histogram.summary(whole_run) for stage, histogram in self.stages.items()}
+
+    def dump(self, path):
+        # CSV gets one summary row per stage; JSON also carries the bucket counts
+        with self.lock:
+            stages = {stage: dict(histogram.summary(), buckets=list(histogram.totals))
+                      for stage, histogram in self.stages.items()}
+        try:
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                if path.endswith(".csv"):
+                    writer = csv.writer(f)
+                    writer.writerow(["stage", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+                    for stage, summary in stages.items():
+                        summary.pop("buckets")
+                        writer.writerow([stage] + list(summary.values()))
+                else:
+                    json.dump({"bucket_limits_ms": [round(bucket_limit(bucket) * 1000, 6) for bucket in range(BUCKETS)],
+                               "stages": stages}, f)
+        except OSError as e:
+            print(f"Profile not written: {e}")
+            return False
+        return True
+
+# Shared by the game and the engine; dumping to a file implies recording from the start
+PROFILER = StageProfiler(PROFILE or bool(PROFILE_FILE))
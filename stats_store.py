@@ -0,0 +1,199 @@
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+# Finished games in a local SQLite file. The game only appends to an in-memory list;
+# a writer thread inserts batches in one transaction each and keeps a totals row per
+# board up to date, so neither recording nor the stats screen ever scans the history.
+#
+#   games    one row per finished game
+#            games_by_board (grid_size, difficulty, finished_at): recent games
+#            games_by_time (grid_size, difficulty, result, elapsed): best times, leaderboards
+#   boards   per (grid_size, difficulty): games played and solved, total solve time, and
+#            the current and longest run of solved games
+#
+#   SUDOKU_STATS_FILE=stats.sqlite3 python "Var final.py"     ('' keeps no statistics)
+#   python benchmarks.py stats --games 300000
+
+# Games written per transaction at most, and seconds a recorded game may wait for one
+STATS_BATCH_SIZE = 256
+STATS_FLUSH_INTERVAL = 2.0
+STATS_FILE = os.getenv('SUDOKU_STATS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), "stats.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    grid_size INTEGER NOT NULL,
+    difficulty TEXT NOT NULL,
+    seed TEXT,
+    finished_at REAL NOT NULL,
+    elapsed INTEGER NOT NULL,
+    mistakes INTEGER NOT NULL,
+    chances_bought INTEGER NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_by_board ON games (grid_size, difficulty, finished_at);
+CREATE INDEX IF NOT EXISTS games_by_time ON games (grid_size, difficulty, result, elapsed);
+CREATE TABLE IF NOT EXISTS boards (
+    grid_size INTEGER NOT NULL,
+    difficulty TEXT NOT NULL,
+    played INTEGER NOT NULL,
+    solved INTEGER NOT NULL,
+    solved_seconds INTEGER NOT NULL,
+    streak INTEGER NOT NULL,
+    longest_streak INTEGER NOT NULL,
+    PRIMARY KEY (grid_size, difficulty)
+);
+"""
+
+GameResult = collections.namedtuple("GameResult", "grid_size difficulty seed finished_at elapsed mistakes chances_bought result")
+
+def connect(path):
+    # WAL lets the stats screen read while the writer thread commits
+    connection = sqlite3.connect(path, timeout=5.0)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+class StatsStore:
+    def __init__(self, path, batch_size=STATS_BATCH_SIZE, flush_interval=STATS_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.drained = threading.Event()
+        self.drained.set()
+        self.running = threading.Event()
+        self.thread = None
+        self.reader = None
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    def start(self):
+        if self.thread is None:
+            self.running.set()
+            self.thread = threading.Thread(target=self.write_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=5.0):
+        # Writes whatever is still pending before the thread exits
+        self.running.clear()
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+
+    def record(self, grid_size, difficulty, seed, elapsed, mistakes, chances_bought, result, finished_at=None):
+        game = GameResult(grid_size, difficulty, seed, finished_at or time.time(), elapsed, mistakes, chances_bought, result)
+        with self.lock:
+            self.pending.append(game)
+            self.drained.clear()
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wake.set()
+
+    def flush(self, timeout=2.0):
+        # Waits until everything recorded so far is committed, e.g. before showing stats
+        self.wake.set()
+        return self.drained.wait(timeout)
+
+    def write_loop(self):
+        try:
+            connection = connect(self.path)
+        except sqlite3.Error as e:
+            print(f"Stats store not opened: {e}")
+            self.drained.set()
+            return
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            # Swapped out whole so record() never waits for more than an append
+            with self.lock:
+                games, self.pending = self.pending, []
+            for index in range(0, len(games), self.batch_size):
+                batch = games[index:index + self.batch_size]
+                try:
+                    with connection:
+                        self.write_batch(connection, batch)
+                    self.written += len(batch)
+                    self.batches += 1
+                except sqlite3.Error as e:
+                    self.failed += len(batch)
+                    print(f"Stats not written: {e}")
+            with self.lock:
+                if not self.pending:
+                    self.drained.set()
+            if not self.running.is_set():
+                break
+        connection.close()
+
+    def write_batch(self, connection, batch):
+        connection.executemany("INSERT INTO games (grid_size, difficulty, seed, finished_at, elapsed, mistakes, chances_bought, result)"
+                               " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+        # Totals and streaks are carried forward per board rather than recomputed from the history
+        boards = {}
+        for game in batch:
+            key = (game.grid_size, game.difficulty)
+            if key not in boards:
+                row = connection.execute("SELECT played, solved, solved_seconds, streak, longest_streak FROM boards"
+                                         " WHERE grid_size = ? AND difficulty = ?", key).fetchone()
+                boards[key] = list(row or (0, 0, 0, 0, 0))
+            board = boards[key]
+            board[0] += 1
+            if game.result == "solved":
+                board[1] += 1
+                board[2] += game.elapsed
+                board[3] += 1
+                board[4] = max(board[4], board[3])
+            else:
+                board[3] = 0
+        connection.executemany("INSERT OR REPLACE INTO boards (grid_size, difficulty, played, solved, solved_seconds, streak, longest_streak)"
+                               " VALUES (?, ?, ?, ?, ?, ?, ?)", [key + tuple(board) for key, board in boards.items()])
+
+    def query(self, sql, parameters=()):
+        # Reads on the calling thread through its own connection
+        if self.reader is None:
+            self.reader = connect(self.path)
+        return self.reader.execute(sql, parameters).fetchall()
+
+    def best_times(self, grid_size, difficulty, limit=10):
+        # [(elapsed, mistakes, finished_at)] of the fastest solved games, fastest first
+        return self.query("SELECT elapsed, mistakes, finished_at FROM games"
+                          " WHERE grid_size = ? AND difficulty = ? AND result = 'solved' ORDER BY elapsed LIMIT ?",
+                          (grid_size, difficulty, limit))
+
+    def recent(self, grid_size, difficulty, limit=10):
+        return self.query("SELECT finished_at, elapsed, mistakes, chances_bought, result FROM games"
+                          " WHERE grid_size = ? AND difficulty = ? ORDER BY finished_at DESC LIMIT ?",
+                          (grid_size, difficulty, limit))
+
+    def summary(self, grid_size, difficulty):
+        # Games played and solved, best and average solve time (None without a solve), and
+        # the current and longest streak of solves; a row lookup and one index probe
+        rows = self.query("SELECT played, solved, solved_seconds, streak, longest_streak FROM boards"
+                          " WHERE grid_size = ? AND difficulty = ?", (grid_size, difficulty))
+        played, solved, solved_seconds, streak, longest_streak = rows[0] if rows else (0, 0, 0, 0, 0)
+        best = self.best_times(grid_size, difficulty, 1)
+        return {"played": played, "solved": solved, "best": best[0][0] if best else None,
+                "average": solved_seconds / solved if solved else None, "streak": streak, "longest_streak": longest_streak}
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.pending)
+        return {"pending": pending, "written": self.written, "batches": self.batches, "failed": self.failed}
+
+def open_stats(path=STATS_FILE):
+    if not path:
+        return None
+    store = StatsStore(path)
+    store.start()
+    return store
@@ -0,0 +1,160 @@
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+import time
+
+from sudoku_engine import BoardTracker, check_sudoku, check_sudoku_batch, format_grid, parse_puzzle, solve_grid
+
+# Offline checker for puzzle collections: reads one puzzle per line (81 characters for
+# 9x9, 256 for 16x16) from files or stdin, solves each one with the game's own solver
+# and writes one JSON object per line, in input order. Each worker validates the
+# solutions of a chunk together with check_sudoku_batch when numpy is installed.
+#
+#   python sudoku_batch.py puzzles.txt > results.jsonl
+#   cat a.txt b.txt | python sudoku_batch.py --workers 4 -o results.jsonl
+
+# Puzzles handed to a worker process at a time
+CHUNK_SIZE = 64
+# Seconds the solver may spend on one puzzle before it is reported as a timeout
+PUZZLE_TIMEOUT = 10.0
+# Seconds between progress lines on stderr
+PROGRESS_INTERVAL = 0.5
+
+def check_puzzle(text, timeout=PUZZLE_TIMEOUT):
+    result, solution = solve_puzzle(text, timeout)
+    if solution:
+        result["valid"] = check_sudoku(solution, len(solution))
+    return result
+
+def solve_puzzle(text, timeout):
+    # (result without "valid", solution grid or None)
+    result = {"puzzle": text}
+    try:
+        grid = parse_puzzle(text)
+    except ValueError as e:
+        result.update(status="invalid", error=str(e))
+        return result, None
+    grid_size = len(grid)
+    box_size = int(round(grid_size ** 0.5))
+    result["size"] = grid_size
+    result["givens"] = sum(1 for row in grid for num in row if num)
+    if BoardTracker(grid, box_size).duplicates:
+        result.update(status="invalid", error="conflicting givens")
+        return result, None
+    start = time.perf_counter()
+    try:
+        count, solution = solve_grid(grid, grid_size, box_size, limit=2, deadline=start + timeout)
+    except TimeoutError:
+        count, solution = None, None
+    result["seconds"] = round(time.perf_counter() - start, 6)
+    if count is None:
+        result["status"] = "timeout"
+    else:
+        result["status"] = ("unsolvable", "unique", "multiple")[count]
+        result["solutions"] = count
+    if solution:
+        result["solution"] = format_grid(solution)
+    return result, solution
+
+def validate_solutions(solved):
+    # Sets "valid" on each (result, solution) pair, with one check_sudoku_batch call per
+    # board size
+    by_size = collections.defaultdict(list)
+    for result, solution in solved:
+        by_size[len(solution)].append((result, solution))
+    for pairs in by_size.values():
+        try:
+            valid = check_sudoku_batch([solution for _, solution in pairs]).tolist()
+        except ImportError:
+            valid = [check_sudoku(solution, len(solution)) for _, solution in pairs]
+        for (result, _), ok in zip(pairs, valid):
+            result["valid"] = ok
+
+def check_chunk(lines, timeout):
+    # Runs in a worker; serializing here keeps the parent process down to writing lines
+    checked = [solve_puzzle(line, timeout) for line in lines]
+    validate_solutions([(result, solution) for result, solution in checked if solution])
+    return [(result["status"], json.dumps(result)) for result, _ in checked]
+
+def read_puzzles(paths):
+    # Lazily yields puzzle lines; blank lines and '#' comments are skipped
+    for path in paths or ["-"]:
+        stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        try:
+            for line in stream:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+def chunked(lines, size):
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+def run_batch(paths, output, workers=None, chunk_size=CHUNK_SIZE, timeout=PUZZLE_TIMEOUT, progress=sys.stderr):
+    # At most two chunks per worker are in flight, so memory stays flat however long
+    # the input is; results are written as soon as the oldest chunk is done.
+    workers = workers or os.cpu_count() or 1
+    counts = collections.Counter()
+    done = 0
+    start = time.perf_counter()
+    last_progress = start
+
+    def report(final=False):
+        elapsed = time.perf_counter() - start
+        rate = done / elapsed if elapsed else 0.0
+        line = f"\r{done} puzzles, {rate:.0f}/s, " + ", ".join(f"{status} {count}" for status, count in sorted(counts.items()))
+        progress.write(line + ("\n" if final else ""))
+        progress.flush()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        chunks = chunked(read_puzzles(paths), chunk_size)
+        while True:
+            while len(pending) < workers * 2:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.append(pool.submit(check_chunk, chunk, timeout))
+            if not pending:
+                break
+            for status, line in pending.popleft().result():
+                output.write(line + "\n")
+                counts[status] += 1
+                done += 1
+            if progress and time.perf_counter() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.perf_counter()
+                report()
+    output.flush()
+    if progress:
+        report(final=True)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve and check sudoku puzzles in bulk, one JSON result per line")
+    parser.add_argument("inputs", nargs="*", help="puzzle files, one puzzle per line ('-' or nothing for stdin)")
+    parser.add_argument("-o", "--output", help="JSONL output file (default stdout)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--timeout", type=float, default=PUZZLE_TIMEOUT, help="seconds per puzzle")
+    parser.add_argument("--quiet", action="store_true", help="no progress line")
+    args = parser.parse_args()
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        run_batch(args.inputs, output, args.workers, args.chunk_size, args.timeout, None if args.quiet else sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
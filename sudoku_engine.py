@@ -0,0 +1,1729 @@
+import array
+import collections
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+from stage_profiler import PROFILER
+
+# Game rules, generation and session state. Nothing here depends on pygame, so it can be
+# used from batch jobs, servers and tests; "Var final.py" is one client on top of it.
+
+# Fewest and most blanks carved into each 9x9 candidate puzzle, drawn anew per attempt;
+# which difficulty a puzzle belongs to is decided by its grade, see TECHNIQUE_BANDS
+DIFFICULTIES = {
+    "usor": (36, 46),
+    "mediu": (50, 60),
+    "greu": (56, 64)
+}
+# Weight range (inclusive) of the hardest technique grade_puzzle needs for each 9x9
+# difficulty: usor is singles only, mediu needs pointing or claiming, and greu pairs,
+# triples or fish. A puzzle the ladder cannot finish ("guess") fits none of them. Only
+# 9x9 is banded: the BOX_DIFFICULTIES boards are told apart by their blank count alone.
+TECHNIQUE_BANDS = {
+    "usor": (1, 2),
+    "mediu": (6, 6),
+    "greu": (10, 30)
+}
+# Candidates carved for a band before the one closest to it is taken; about one in ten
+# carves needs pointing and one in fifteen pairs or fish
+GRADE_ATTEMPTS = 80
+# Seconds the background generator lets one seed search for its band before it moves on
+# to a new seed (a greu seed usually takes about one)
+GRADE_TIME_BUDGET = 2.0
+# Big boards by box size ("4x4" boxes make a 16x16 board) and the blanks carved into them
+BOX_DIFFICULTIES = {
+    "4x4": 150,
+    "5x5": 280,
+    "6x6": 540
+}
+# From this board size on, solved grids come from a shuffled pattern and carving only
+# blanks cells the remaining givens force, as a search would take seconds
+PATTERN_GRID_SIZE = 25
+# Upper bound in seconds for carving one puzzle without a seed; past it the puzzle keeps
+# the blanks it already has
+CARVE_TIME_BUDGET = 1.0
+# Solver steps allowed for proving a single blank keeps the solution unique; a step
+# count rather than a time, so a seeded carve gives the same puzzle on every machine
+CELL_CHECK_STEPS = 50
+# Uniqueness checks allowed for carving one puzzle, per row of the board. Seeded carving
+# has no time budget, so this (times CELL_CHECK_STEPS) is what bounds it; typical carves
+# need about two thirds of it.
+CARVE_CHECKS = 6
+# Ready puzzles kept per difficulty by the background generator (0 disables it)
+POOL_SIZE = int(os.getenv('SUDOKU_POOL_SIZE', '3'))
+# Worker processes the background generator carves and grades in (0 keeps it on its thread)
+GENERATION_WORKERS = int(os.getenv('SUDOKU_GENERATION_WORKERS', '1'))
+# "derive" hands out transformed copies of a few seed puzzles, "generate" builds each one
+GENERATION_MODE = os.getenv('SUDOKU_GENERATION', 'derive')
+# Generated seed puzzles kept per difficulty in derive mode
+SEED_LIBRARY_SIZE = int(os.getenv('SUDOKU_SEED_LIBRARY_SIZE', '4'))
+# Seeded puzzles kept in memory, least recently used evicted first
+PUZZLE_CACHE_SIZE = 256
+# JSON file the seeded puzzles are also kept in between runs ('' keeps them in memory only)
+PUZZLE_CACHE_FILE = os.getenv('SUDOKU_PUZZLE_CACHE_FILE', '')
+# Move journal: buffered entries are written out after this many moves or seconds, and a
+# full snapshot is added every JOURNAL_SNAPSHOT_MOVES moves so resuming replays a short tail
+JOURNAL_FLUSH_MOVES = 20
+JOURNAL_FLUSH_INTERVAL = 2.0
+JOURNAL_SNAPSHOT_MOVES = 50
+
+def box_index(row, col, box_size):
+    return (row // box_size) * box_size + col // box_size
+
+# Cell indices (row * n + col) of every row, column and box, in that order, per board size
+UNIT_INDEX = {}
+
+def unit_cells(grid_size, box_size):
+    units = UNIT_INDEX.get(grid_size)
+    if units is None:
+        rows = [[row * grid_size + col for col in range(grid_size)] for row in range(grid_size)]
+        cols = [[row * grid_size + col for row in range(grid_size)] for col in range(grid_size)]
+        boxes = [[row * grid_size + col for row in range(grid_size) for col in range(grid_size)
+                  if box_index(row, col, box_size) == box] for box in range(grid_size)]
+        units = UNIT_INDEX[grid_size] = rows + cols + boxes
+    return units
+
+# Sorted peer indices (same row, column or box, the cell itself included) of every cell, per board size
+PEER_INDEX = {}
+
+def peer_cells(grid_size, box_size):
+    peers = PEER_INDEX.get(grid_size)
+    if peers is None:
+        units = unit_cells(grid_size, box_size)
+        peers = PEER_INDEX[grid_size] = [
+            sorted(set(units[row] + units[grid_size + col] + units[2 * grid_size + box_index(row, col, box_size)]))
+            for row in range(grid_size) for col in range(grid_size)]
+    return peers
+
+def solve_grid(grid, grid_size=9, box_size=3, limit=1, randomize=False, max_steps=None, deadline=None, excluded=None, rng=None, hidden_singles=None):
+    # Bitmask solver: one occupancy mask per row, column and box. With hidden_singles
+    # every node first propagates naked and hidden singles, then branches on the empty
+    # cell with the fewest candidates (MRV); without, it only fills the MRV cell next.
+    # excluded=(row, col, num) forbids one digit in one empty cell. randomize shuffles
+    # the branch order with rng (the random module by default).
+    # Propagation prunes the exhaustive searches of counting and uniqueness checks, but a
+    # random fill of an empty grid rarely backtracks and would pay for it at every node,
+    # so by default it is used only when not randomizing.
+    if hidden_singles is None:
+        hidden_singles = not randomize
+    # Returns (number of solutions up to limit, first solution).
+    full_mask = (1 << grid_size) - 1
+    row_used = [0] * grid_size
+    col_used = [0] * grid_size
+    box_used = [0] * grid_size
+    board = [row[:] for row in grid]
+    empty = []
+    for row in range(grid_size):
+        for col in range(grid_size):
+            box = box_index(row, col, box_size)
+            num = board[row][col]
+            if num == 0:
+                blocked = 0
+                if excluded and excluded[0] == row and excluded[1] == col:
+                    blocked = 1 << (excluded[2] - 1)
+                empty.append((row, col, box, blocked))
+                continue
+            bit = 1 << (num - 1)
+            if (row_used[row] | col_used[col] | box_used[box]) & bit:
+                return 0, None
+            row_used[row] |= bit
+            col_used[col] |= bit
+            box_used[box] |= bit
+
+    solutions = 0
+    first_solution = None
+    steps = 0
+
+    def place(cell, bit):
+        row, col, box, _ = cell
+        row_used[row] |= bit
+        col_used[col] |= bit
+        box_used[box] |= bit
+        board[row][col] = bit.bit_length()
+
+    def unplace(cell):
+        row, col, box, _ = cell
+        bit = 1 << (board[row][col] - 1)
+        row_used[row] ^= bit
+        col_used[col] ^= bit
+        box_used[box] ^= bit
+        board[row][col] = 0
+
+    def propagate(remaining, placed):
+        # Fills forced cells in place; returns (remaining, best cell, its mask), with a
+        # best cell of None once the board is full and False on a contradiction.
+        while remaining:
+            best_cell = None
+            best_mask = 0
+            best_count = grid_size + 1
+            progress = False
+            open_cells = []
+            row_once = [0] * grid_size
+            row_twice = [0] * grid_size
+            col_once = [0] * grid_size
+            col_twice = [0] * grid_size
+            box_once = [0] * grid_size
+            box_twice = [0] * grid_size
+            for cell in empty:
+                row, col, box, blocked = cell
+                if board[row][col]:
+                    continue
+                mask = full_mask & ~(row_used[row] | col_used[col] | box_used[box] | blocked)
+                count = mask.bit_count()
+                if count == 0:
+                    return remaining, False, 0
+                if count == 1:
+                    place(cell, mask)
+                    placed.append(cell)
+                    remaining -= 1
+                    progress = True
+                    continue
+                if progress:
+                    continue
+                if count < best_count:
+                    best_cell, best_mask, best_count = cell, mask, count
+                open_cells.append((cell, mask))
+                row_twice[row] |= row_once[row] & mask
+                row_once[row] |= mask
+                col_twice[col] |= col_once[col] & mask
+                col_once[col] |= mask
+                box_twice[box] |= box_once[box] & mask
+                box_once[box] |= mask
+            if progress:
+                continue
+
+            # Hidden singles: a digit with one possible cell in some row, column or box
+            # is forced there; a digit with no possible cell is a dead end.
+            hidden_cell = None
+            units = ((row_once, row_twice, row_used), (col_once, col_twice, col_used), (box_once, box_twice, box_used))
+            for unit, (once, twice, used) in enumerate(units):
+                for u in range(grid_size):
+                    if (once[u] | used[u]) != full_mask:
+                        return remaining, False, 0
+                    hidden = once[u] & ~twice[u]
+                    if hidden and hidden_cell is None:
+                        bit = hidden & -hidden
+                        for cell, mask in open_cells:
+                            if cell[unit] == u and mask & bit:
+                                hidden_cell = cell
+                                break
+            if hidden_cell is None:
+                return remaining, best_cell, best_mask
+            place(hidden_cell, bit)
+            placed.append(hidden_cell)
+            remaining -= 1
+        return remaining, None, 0
+
+    def search(remaining):
+        nonlocal solutions, first_solution, steps
+        steps += 1
+        if max_steps is not None and steps > max_steps:
+            raise TimeoutError("solver step limit reached")
+        if deadline is not None and steps & 15 == 0 and time.perf_counter() > deadline:
+            raise TimeoutError("solver deadline reached")
+
+        placed = []
+        remaining, cell, mask = propagate(remaining, placed)
+        done = False
+        if cell is None:
+            solutions += 1
+            if first_solution is None:
+                first_solution = [row[:] for row in board]
+            done = solutions >= limit
+        elif cell is not False:
+            bits = []
+            while mask:
+                bit = mask & -mask
+                bits.append(bit)
+                mask ^= bit
+            if randomize:
+                (rng or random).shuffle(bits)
+            for bit in bits:
+                place(cell, bit)
+                done = search(remaining - 1)
+                unplace(cell)
+                if done:
+                    break
+        for placed_cell in placed:
+            unplace(placed_cell)
+        return done
+
+    def fill(depth):
+        # empty[:depth] is filled; the MRV cell is swapped to empty[depth] and tried
+        nonlocal solutions, first_solution, steps
+        if depth == len(empty):
+            solutions += 1
+            if first_solution is None:
+                first_solution = [row[:] for row in board]
+            return solutions >= limit
+        steps += 1
+        if max_steps is not None and steps > max_steps:
+            raise TimeoutError("solver step limit reached")
+        if deadline is not None and steps & 63 == 0 and time.perf_counter() > deadline:
+            raise TimeoutError("solver deadline reached")
+        best_index = depth
+        best_mask = 0
+        best_count = grid_size + 1
+        for index in range(depth, len(empty)):
+            row, col, box, blocked = empty[index]
+            mask = full_mask & ~(row_used[row] | col_used[col] | box_used[box] | blocked)
+            count = mask.bit_count()
+            if count < best_count:
+                best_index, best_mask, best_count = index, mask, count
+                if count <= 1:
+                    break
+        if best_count == 0:
+            return False
+        empty[depth], empty[best_index] = empty[best_index], empty[depth]
+        cell = empty[depth]
+        bits = []
+        while best_mask:
+            bit = best_mask & -best_mask
+            bits.append(bit)
+            best_mask ^= bit
+        if randomize:
+            (rng or random).shuffle(bits)
+        for bit in bits:
+            place(cell, bit)
+            done = fill(depth + 1)
+            unplace(cell)
+            if done:
+                return True
+        return False
+
+    if hidden_singles:
+        search(len(empty))
+    else:
+        fill(0)
+    return solutions, first_solution
+
+def random_symmetry(grid_size, box_size, rng=None):
+    # A random map that sends valid grids to valid grids and unique puzzles to unique
+    # ones: a row order shuffling bands and the rows inside each band, the same for
+    # columns and stacks, a digit relabelling, a transposition and 0-3 quarter turns.
+    rng = rng or random
+    def shuffled_lines():
+        return [band * box_size + line for band in rng.sample(range(box_size), box_size)
+                for line in rng.sample(range(box_size), box_size)]
+    digits = [0] + rng.sample(range(1, grid_size + 1), grid_size)
+    return shuffled_lines(), shuffled_lines(), digits, rng.random() < 0.5, rng.randrange(4)
+
+def apply_symmetry(grid, symmetry):
+    # O(n²); blanks stay blank, so a solution and its puzzle can share one symmetry
+    rows, cols, digits, transpose, turns = symmetry
+    if transpose:
+        grid = [list(col) for col in zip(*grid)]
+    for _ in range(turns):
+        grid = [list(row) for row in zip(*grid[::-1])]
+    return [[digits[grid[row][col]] for col in cols] for row in rows]
+
+def pattern_solved_grid(grid_size, box_size, rng=None):
+    # The shifted-row pattern is a valid grid, and so is any symmetry of it
+    pattern = [[(box_size * (row % box_size) + row // box_size + col) % grid_size + 1 for col in range(grid_size)]
+               for row in range(grid_size)]
+    return apply_symmetry(pattern, random_symmetry(grid_size, box_size, rng))
+
+@PROFILER.timed("generate_solved_grid")
+def generate_solved_grid(grid_size=9, box_size=3, rng=None):
+    if grid_size >= PATTERN_GRID_SIZE:
+        return pattern_solved_grid(grid_size, box_size, rng)
+    empty_grid = [[0 for _ in range(grid_size)] for _ in range(grid_size)]
+    # A random fill very rarely wanders into a deep dead end; restarting with a fresh
+    # shuffle is much cheaper than backtracking out of it.
+    max_steps = 4 * grid_size * grid_size
+    while True:
+        try:
+            count, solution = solve_grid(empty_grid, grid_size, box_size, randomize=True, max_steps=max_steps, rng=rng)
+        except TimeoutError:
+            continue
+        if count:
+            return solution
+
+def count_solutions(grid, grid_size, box_size, limit=2, deadline=None):
+    count, _ = solve_grid(grid, grid_size, box_size, limit=limit, deadline=deadline)
+    return count
+
+def is_forced_cell(puzzle, row, col, num, used, units, box_size):
+    # True when the givens alone force num into the blank at (row, col): it is the only
+    # candidate there (naked single), or no other blank of one of its units can take it
+    # (hidden single). used holds the given digits of every row, column and box.
+    grid_size = len(puzzle)
+    row_used, col_used, box_used = used
+    bit = 1 << (num - 1)
+    box = box_index(row, col, box_size)
+    if (row_used[row] | col_used[col] | box_used[box]).bit_count() == grid_size - 1:
+        return True
+    for unit in (units[row], units[grid_size + col], units[2 * grid_size + box]):
+        for index in unit:
+            other_row, other_col = divmod(index, grid_size)
+            if puzzle[other_row][other_col] or (other_row == row and other_col == col):
+                continue
+            if not (row_used[other_row] | col_used[other_col] | box_used[box_index(other_row, other_col, box_size)]) & bit:
+                break
+        else:
+            return True
+    return False
+
+@PROFILER.timed("create_puzzle")
+def create_puzzle(board, num_empty_cells=40, time_budget=CARVE_TIME_BUDGET, rng=None):
+    # With time_budget=None only the step and check limits apply, so the result depends
+    # on rng alone
+    grid_size = len(board)
+    box_size = int(round(grid_size ** 0.5))
+    puzzle = [row[:] for row in board]
+    cells = [(row, col) for row in range(grid_size) for col in range(grid_size)]
+    (rng or random).shuffle(cells)
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    checks = CARVE_CHECKS * grid_size
+    units = unit_cells(grid_size, box_size)
+    used = ([0] * grid_size, [0] * grid_size, [0] * grid_size)
+    for row in range(grid_size):
+        for col in range(grid_size):
+            bit = 1 << (puzzle[row][col] - 1)
+            used[0][row] |= bit
+            used[1][col] |= bit
+            used[2][box_index(row, col, box_size)] |= bit
+    count = 0
+    for row, col in cells:
+        if count >= num_empty_cells:
+            break
+        num = puzzle[row][col]
+        bit = 1 << (num - 1)
+        box = box_index(row, col, box_size)
+        puzzle[row][col] = 0
+        used[0][row] ^= bit
+        used[1][col] ^= bit
+        used[2][box] ^= bit
+        # Blanking a forced cell never changes the set of solutions, so these need no search
+        if is_forced_cell(puzzle, row, col, num, used, units, box_size):
+            count += 1
+            continue
+        unique = False
+        if grid_size < PATTERN_GRID_SIZE:
+            if not checks:
+                puzzle[row][col] = num
+                print(f"Puzzle carving stopped by check limit after {count} empty cells")
+                break
+            checks -= 1
+            try:
+                # The carved puzzle still has the original solution, so it stays unique exactly
+                # when no solution puts a different digit into the cell just blanked.
+                alternatives, _ = solve_grid(puzzle, grid_size, box_size, max_steps=CELL_CHECK_STEPS, deadline=deadline, excluded=(row, col, num))
+                unique = alternatives == 0
+            except TimeoutError:
+                # A cell whose check runs long is simply kept as a given
+                if deadline is not None and time.perf_counter() >= deadline:
+                    puzzle[row][col] = num
+                    print(f"Puzzle carving stopped by time budget after {count} empty cells")
+                    break
+        if unique:
+            count += 1
+        else:
+            puzzle[row][col] = num
+            used[0][row] |= bit
+            used[1][col] |= bit
+            used[2][box] |= bit
+    return puzzle
+
+def difficulty_settings(dificultate):
+    if dificultate in BOX_DIFFICULTIES:
+        box_size = int(dificultate.split("x")[0])
+        return box_size * box_size, box_size, BOX_DIFFICULTIES[dificultate]
+    return 9, 3, DIFFICULTIES.get(dificultate, (40, 40))
+
+def generate_puzzle(dificultate, rng=None, grade_budget=None):
+    # With an rng the puzzle is fully determined by it (no time budget applies). A
+    # difficulty with a technique band keeps carving candidates, each with its own blank
+    # count, until one grades inside it. Cutting that search short would give a puzzle
+    # the rng does not rebuild, so past grade_budget seconds it raises TimeoutError.
+    grid_size, box_size, num_empty = difficulty_settings(dificultate)
+    time_budget = CARVE_TIME_BUDGET if rng is None else None
+    deadline = None if grade_budget is None else time.perf_counter() + grade_budget
+    band = TECHNIQUE_BANDS.get(dificultate)
+    best = None
+    for _ in range(GRADE_ATTEMPTS if band else 1):
+        solved_grid = generate_solved_grid(grid_size, box_size, rng)
+        if band:
+            num_empty = (rng or random).randint(*DIFFICULTIES[dificultate])
+        puzzle = create_puzzle(solved_grid, num_empty_cells=num_empty, time_budget=time_budget, rng=rng)
+        if not band:
+            return solved_grid, puzzle
+        grade = grade_puzzle(puzzle)
+        weight = GUESS_WEIGHT if grade.hardest == "guess" else TECHNIQUE_WEIGHTS[grade.hardest]
+        low, high = band
+        distance = max(low - weight, weight - high, 0)
+        if best is None or distance < best[0]:
+            best = (distance, solved_grid, puzzle)
+        if distance == 0:
+            break
+        if deadline is not None and time.perf_counter() > deadline:
+            raise TimeoutError(f"no {dificultate} puzzle graded within {grade_budget} s")
+    return best[1], best[2]
+
+def profiled_seeded_puzzle(seed, dificultate, grade_budget=None):
+    # seeded_puzzle for the pool's worker processes: their PROFILER is their own, so the
+    # stage timings travel back with the puzzle and are merged into the game's
+    return PROFILER.collect(seeded_puzzle, seed, dificultate, grade_budget)
+
+def new_seed():
+    return format(random.getrandbits(32), "08x")
+
+def seed_rng(seed, dificultate):
+    grid_size = difficulty_settings(dificultate)[0]
+    return random.Random(f"{seed}:{grid_size}:{dificultate}")
+
+def seeded_puzzle(seed, dificultate, grade_budget=None):
+    # The same (seed, grid size, difficulty) always gives the same puzzle. A seed written
+    # "base~variant" is a symmetry of the puzzle of base, which is how derived puzzles
+    # from a SeedLibrary are named.
+    base, _, variant = seed.partition("~")
+    if variant:
+        solved_grid, puzzle = seeded_puzzle(base, dificultate, grade_budget)
+        grid_size, box_size, _ = difficulty_settings(dificultate)
+        symmetry = random_symmetry(grid_size, box_size, seed_rng(variant, dificultate))
+        return apply_symmetry(solved_grid, symmetry), apply_symmetry(puzzle, symmetry)
+    return generate_puzzle(dificultate, seed_rng(seed, dificultate), grade_budget)
+
+def puzzle_code(dificultate, seed):
+    # What players share: "greu:1f3a9c0b" names one puzzle
+    return f"{dificultate}:{seed}"
+
+def parse_puzzle_code(code):
+    # (difficulty or None, seed) from "difficulty:seed" or a bare seed
+    dificultate, _, seed = code.strip().rpartition(":")
+    dificultate = dificultate.lower().replace("ș", "s")
+    if dificultate not in DIFFICULTIES and dificultate not in BOX_DIFFICULTIES:
+        dificultate = None
+    return dificultate, seed
+
+class PuzzleCache:
+    # Seeded puzzles by (seed, grid size, difficulty), least recently used evicted first.
+    # With a path the cache is also written to disk, so a shared or daily seed loads
+    # without generation on the next run too.
+    def __init__(self, max_size=PUZZLE_CACHE_SIZE, path=PUZZLE_CACHE_FILE):
+        self.max_size = max_size
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if path:
+            self.load()
+
+    def get(self, seed, dificultate):
+        entry = self.lookup(seed, dificultate)
+        if entry is None:
+            entry = seeded_puzzle(seed, dificultate)
+            self.put(seed, dificultate, entry)
+        solved_grid, puzzle = entry
+        return [row[:] for row in solved_grid], [row[:] for row in puzzle]
+
+    def lookup(self, seed, dificultate):
+        # (solution, puzzle) copies, or None on a miss
+        key = (seed, difficulty_settings(dificultate)[0], dificultate)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        solved_grid, puzzle = entry
+        return [row[:] for row in solved_grid], [row[:] for row in puzzle]
+
+    def put(self, seed, dificultate, entry):
+        with self.lock:
+            self.entries[(seed, difficulty_settings(dificultate)[0], dificultate)] = entry
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        if self.path:
+            self.save()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                records = json.load(f)
+            for seed, grid_size, dificultate, solution, puzzle in records[-self.max_size:]:
+                self.entries[(seed, grid_size, dificultate)] = (parse_puzzle(solution), parse_puzzle(puzzle))
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Puzzle cache not loaded: {e}")
+
+    def save(self):
+        with self.lock:
+            records = [[seed, grid_size, dificultate, format_grid(solution), format_grid(puzzle)]
+                       for (seed, grid_size, dificultate), (solution, puzzle) in self.entries.items()]
+        try:
+            # Written aside and renamed, so a crash never leaves a half-written cache
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(records, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Puzzle cache not saved: {e}")
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+class PuzzlePool:
+    # Keeps a few ready puzzles per difficulty, generated by a background thread, so
+    # menu selection and Reset never wait for generation.
+    def __init__(self, size=POOL_SIZE, workers=GENERATION_WORKERS):
+        self.size = size
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self.puzzles = {dificultate: collections.deque() for dificultate in list(DIFFICULTIES) + list(BOX_DIFFICULTIES)}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = threading.Event()
+        self.thread = None
+        self.executor = None
+
+    def start(self):
+        if self.thread is None and self.size > 0:
+            if self.workers > 0:
+                # Carving and grading hold the GIL for milliseconds at a time, so they run in
+                # processes and the thread only waits on them. Spawned rather than forked, as
+                # the game process has SDL and other threads running.
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"))
+            self.running.set()
+            self.thread = threading.Thread(target=self.fill, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        self.wake.set()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def fill(self):
+        while self.running.is_set():
+            with self.lock:
+                missing = [d for d, ready in self.puzzles.items() if len(ready) < self.size]
+            if not missing:
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            # Refill the emptiest difficulty first, so the one just played is ready soonest
+            dificultate = min(missing, key=lambda d: len(self.puzzles[d]))
+            try:
+                entry = self.generate(dificultate)
+            except (RuntimeError, concurrent.futures.CancelledError):
+                # The executor was shut down under us
+                return
+            with self.lock:
+                self.puzzles[dificultate].append(entry)
+
+    def generate(self, dificultate):
+        # Seeded, so every pooled puzzle can be named and rebuilt by seeded_puzzle. A seed
+        # that takes longer than GRADE_TIME_BUDGET to reach its band is dropped for another.
+        while True:
+            seed = new_seed()
+            try:
+                if self.executor and self.running.is_set():
+                    (solved_grid, puzzle), samples = self.executor.submit(profiled_seeded_puzzle, seed, dificultate, GRADE_TIME_BUDGET).result()
+                    PROFILER.merge(samples)
+                else:
+                    solved_grid, puzzle = seeded_puzzle(seed, dificultate, GRADE_TIME_BUDGET)
+            except TimeoutError as e:
+                print(f"Seed {seed} skipped: {e}")
+                continue
+            return solved_grid, puzzle, seed
+
+    def submit(self, seed, dificultate):
+        # A Future of seeded_puzzle(seed, dificultate) from the worker processes, or None
+        # while there are none to run it
+        if not self.executor or not self.running.is_set():
+            return None
+        try:
+            job = self.executor.submit(profiled_seeded_puzzle, seed, dificultate)
+        except RuntimeError:
+            return None
+        future = concurrent.futures.Future()
+
+        def finished(job):
+            try:
+                entry, samples = job.result()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            PROFILER.merge(samples)
+            future.set_result(entry)
+        job.add_done_callback(finished)
+        return future
+
+    def take_ready(self, dificultate):
+        # A ready (solution, puzzle, seed), or None without generating one
+        with self.lock:
+            ready = self.puzzles.setdefault(dificultate, collections.deque())
+            entry = ready.popleft() if ready else None
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self.wake.set()
+        if entry is None:
+            return None
+        solved_grid, puzzle, seed = entry
+        return solved_grid, [row[:] for row in puzzle], seed
+
+    def take(self, dificultate):
+        entry = self.take_ready(dificultate)
+        if entry is None:
+            print(f"Puzzle pool empty for {dificultate}, generating on demand")
+            entry = self.generate(dificultate)
+        return entry
+
+    def stats(self):
+        with self.lock:
+            ready = {d: len(puzzles) for d, puzzles in self.puzzles.items()}
+        return {"size": self.size, "hits": self.hits, "misses": self.misses, "ready": ready}
+
+class SeedLibrary(PuzzlePool):
+    # Derive mode: the background thread fills each difficulty with a few generated and
+    # verified seed puzzles, and take() hands out a random symmetry of one of them. Those
+    # keep uniqueness and the solving path, so a puzzle costs O(n²) and no solving.
+    def __init__(self, size=SEED_LIBRARY_SIZE):
+        super().__init__(size)
+
+    def generate(self, dificultate):
+        while True:
+            solved_grid, puzzle, seed = super().generate(dificultate)
+            grid_size = len(solved_grid)
+            if check_sudoku(solved_grid, grid_size) and all(
+                    puzzle[row][col] in (0, solved_grid[row][col]) for row in range(grid_size) for col in range(grid_size)):
+                return solved_grid, puzzle, seed
+            print(f"Discarding a {dificultate} seed that failed verification")
+
+    def take_ready(self, dificultate):
+        with self.lock:
+            seeds = self.puzzles.setdefault(dificultate, collections.deque())
+            seed = random.choice(seeds) if seeds else None
+            if seed:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self.wake.set()
+        return self.derive(seed, dificultate) if seed else None
+
+    def take(self, dificultate):
+        entry = self.take_ready(dificultate)
+        if entry is None:
+            print(f"No seed puzzle yet for {dificultate}, generating one")
+            seed = self.generate(dificultate)
+            with self.lock:
+                if len(self.puzzles[dificultate]) < self.size:
+                    self.puzzles[dificultate].append(seed)
+            entry = self.derive(seed, dificultate)
+        return entry
+
+    def derive(self, seed, dificultate):
+        solved_grid, puzzle, base = seed
+        # The variant seeds the symmetry, so seeded_puzzle("base~variant") rebuilds it
+        variant = new_seed()
+        symmetry = random_symmetry(len(solved_grid), int(round(len(solved_grid) ** 0.5)), seed_rng(variant, dificultate))
+        return apply_symmetry(solved_grid, symmetry), apply_symmetry(puzzle, symmetry), f"{base}~{variant}"
+
+def make_puzzle_pool():
+    if GENERATION_MODE == "generate":
+        return PuzzlePool()
+    return SeedLibrary()
+
+def is_valid_move(grid, row, col, num, box_size):
+    for i in range(len(grid)):
+        if i != col and grid[row][i] == num:
+            return False
+        if i != row and grid[i][col] == num:
+            return False
+    start_row, start_col = box_size * (row // box_size), box_size * (col // box_size)
+    for i in range(start_row, start_row + box_size):
+        for j in range(start_col, start_col + box_size):
+            if (i != row or j != col) and grid[i][j] == num:
+                return False
+    return True
+
+def check_sudoku(grid, grid_size):
+    for i in range(grid_size):
+        row = [grid[i][j] for j in range(grid_size) if grid[i][j] != 0]
+        col = [grid[j][i] for j in range(grid_size) if grid[j][i] != 0]
+        if len(row) != len(set(row)) or len(col) != len(set(col)):
+            return False
+    box_size = int(round(grid_size ** 0.5))
+    for row in range(0, grid_size, box_size):
+        for col in range(0, grid_size, box_size):
+            subgrid = [grid[r][c] for r in range(row, row + box_size) for c in range(col, col + box_size) if grid[r][c] != 0]
+            if len(subgrid) != len(set(subgrid)):
+                return False
+    return all(grid[r][c] != 0 for r in range(grid_size) for c in range(grid_size))
+
+def check_sudoku_batch(boards):
+    # check_sudoku for a whole (N, n, n) array at once; returns a boolean mask, one entry
+    # per board. Rows, columns and boxes are stacked into 3n units per board and sorted,
+    # so a repeated non-zero value shows up as two equal neighbours. numpy is only
+    # needed by this function, so it is imported here.
+    import numpy as np
+    boards = np.asarray(boards)
+    count, grid_size = boards.shape[0], boards.shape[1]
+    box_size = int(round(grid_size ** 0.5))
+    boxes = boards.reshape(count, box_size, box_size, box_size, box_size).transpose(0, 1, 3, 2, 4).reshape(count, grid_size, grid_size)
+    units = np.sort(np.concatenate((boards, boards.transpose(0, 2, 1), boxes), axis=1), axis=2)
+    repeated = (units[:, :, 1:] == units[:, :, :-1]) & (units[:, :, 1:] != 0)
+    return ~repeated.any(axis=(1, 2)) & (boards != 0).all(axis=(1, 2))
+
+# Text form of a grid: one character per cell, row by row, as in the usual 81-character
+# puzzle files. Values past 9 use letters like the game does (A = 10, ..., Z = 35) and
+# 36 is '0'; '.' is an empty cell, and so is '0' on boards smaller than 36x36.
+SYMBOLS = "123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ0"
+
+def parse_puzzle(text):
+    text = text.strip()
+    grid_size = int(round(len(text) ** 0.5))
+    box_size = int(round(grid_size ** 0.5))
+    if grid_size < 4 or grid_size * grid_size != len(text) or box_size * box_size != grid_size:
+        raise ValueError(f"{len(text)} characters is not a square sudoku")
+    values = []
+    for ch in text.upper():
+        if ch == "." or (ch == "0" and grid_size < 36):
+            values.append(0)
+            continue
+        num = SYMBOLS.find(ch) + 1
+        if not 1 <= num <= grid_size:
+            raise ValueError(f"symbol {ch!r} is not valid on a {grid_size}x{grid_size} board")
+        values.append(num)
+    return [values[row * grid_size:(row + 1) * grid_size] for row in range(grid_size)]
+
+def format_grid(grid):
+    return "".join(SYMBOLS[num - 1] if num else "." for row in grid for num in row)
+
+def mask_array(grid_size, value=0):
+    # One bitmask per cell; 32-bit items hold up to 32 digits, bigger boards need 64
+    return array.array('I' if grid_size <= 32 else 'Q', [value]) * (grid_size * grid_size)
+
+# Digits for each candidate bitmask (bit num - 1 set for note num), filled on first use
+NOTE_DIGITS = {}
+
+def mask_digits(mask):
+    digits = NOTE_DIGITS.get(mask)
+    if digits is None:
+        digits = NOTE_DIGITS[mask] = tuple(num + 1 for num in range(mask.bit_length()) if mask >> num & 1)
+    return digits
+
+class Board:
+    # Compact board state: digits in a flat bytearray, notes as one candidate bitmask
+    # per cell, givens and error flags as integer bitsets over the n*n cell indices.
+    # copy() and snapshot() are a handful of buffer copies; grid_view() and friends give
+    # the [row][col] access the drawing code and the solver expect.
+    __slots__ = ("grid_size", "box_size", "cells", "notes", "givens", "errors")
+
+    def __init__(self, grid_size, box_size=None):
+        self.grid_size = grid_size
+        self.box_size = box_size or int(round(grid_size ** 0.5))
+        self.cells = bytearray(grid_size * grid_size)
+        self.notes = mask_array(grid_size)
+        self.givens = 0
+        self.errors = 0
+
+    @classmethod
+    def from_grid(cls, grid, box_size=None):
+        board = cls(len(grid), box_size)
+        index = 0
+        for row in grid:
+            for value in row:
+                if value:
+                    board.cells[index] = value
+                    board.givens |= 1 << index
+                index += 1
+        return board
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        grid_size, box_size, cells, notes, givens, errors = snapshot
+        board = cls.__new__(cls)
+        board.grid_size, board.box_size = grid_size, box_size
+        board.cells = bytearray(cells)
+        board.notes = mask_array(grid_size)[:0]
+        board.notes.frombytes(notes)
+        board.givens, board.errors = givens, errors
+        return board
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.grid_size, board.box_size = self.grid_size, self.box_size
+        board.cells = bytearray(self.cells)
+        board.notes = array.array(self.notes.typecode, self.notes)
+        board.givens, board.errors = self.givens, self.errors
+        return board
+
+    def snapshot(self):
+        # Immutable and picklable: safe to keep for undo or to hand to another process
+        return (self.grid_size, self.box_size, bytes(self.cells), self.notes.tobytes(), self.givens, self.errors)
+
+    def get(self, row, col):
+        return self.cells[row * self.grid_size + col]
+
+    def set(self, row, col, num):
+        self.cells[row * self.grid_size + col] = num
+
+    def is_given(self, row, col):
+        return self.givens >> (row * self.grid_size + col) & 1 == 1
+
+    def is_error(self, row, col):
+        return self.errors >> (row * self.grid_size + col) & 1 == 1
+
+    def set_error(self, row, col, flag):
+        bit = 1 << (row * self.grid_size + col)
+        self.errors = self.errors | bit if flag else self.errors & ~bit
+
+    def cell_notes(self, row, col):
+        return mask_digits(self.notes[row * self.grid_size + col])
+
+    def has_note(self, row, col, num):
+        return self.notes[row * self.grid_size + col] >> (num - 1) & 1 == 1
+
+    def toggle_note(self, row, col, num):
+        self.notes[row * self.grid_size + col] ^= 1 << (num - 1)
+
+    def clear_notes(self, row, col):
+        self.notes[row * self.grid_size + col] = 0
+
+    def to_lists(self):
+        n = self.grid_size
+        return [list(self.cells[row * n:(row + 1) * n]) for row in range(n)]
+
+    def grid_view(self):
+        return BoardView(self, DigitRow)
+
+    def notes_view(self):
+        return BoardView(self, NotesRow)
+
+    def givens_view(self):
+        return BoardView(self, GivenRow)
+
+    def errors_view(self):
+        return BoardView(self, ErrorRow)
+
+class BoardView:
+    # Read-through list-of-lists facade over a Board: view[row][col]
+    __slots__ = ("rows",)
+
+    def __init__(self, board, row_type):
+        self.rows = [row_type(board, row * board.grid_size) for row in range(board.grid_size)]
+
+    def __getitem__(self, row):
+        return self.rows[row]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+class BoardRow:
+    __slots__ = ("board", "offset")
+
+    def __init__(self, board, offset):
+        self.board = board
+        self.offset = offset
+
+    def __len__(self):
+        return self.board.grid_size
+
+    def __iter__(self):
+        return (self[col] for col in range(self.board.grid_size))
+
+class DigitRow(BoardRow):
+    __slots__ = ()
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            # a copy, like list slicing, so row[:] never aliases the board
+            return list(self.board.cells[self.offset:self.offset + self.board.grid_size])[col]
+        return self.board.cells[self.offset + col]
+
+    def __setitem__(self, col, num):
+        self.board.cells[self.offset + col] = num
+
+    def __iter__(self):
+        return iter(self.board.cells[self.offset:self.offset + self.board.grid_size])
+
+class NotesRow(BoardRow):
+    __slots__ = ()
+
+    def __getitem__(self, col):
+        return mask_digits(self.board.notes[self.offset + col])
+
+    def __iter__(self):
+        return map(mask_digits, self.board.notes[self.offset:self.offset + self.board.grid_size])
+
+class GivenRow(BoardRow):
+    __slots__ = ()
+
+    def __getitem__(self, col):
+        return self.board.givens >> (self.offset + col) & 1 == 1
+
+class ErrorRow(BoardRow):
+    __slots__ = ()
+
+    def __getitem__(self, col):
+        return self.board.errors >> (self.offset + col) & 1 == 1
+
+Hint = collections.namedtuple("Hint", "technique row col num eliminations")
+
+def cell_digits(mask):
+    return [num for num in range(1, mask.bit_length() + 1) if mask >> (num - 1) & 1]
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+# Techniques: each takes the board size and a flat list of candidate bitmasks (0 for
+# filled cells) and returns the first Hint it finds, or None. A placement has no
+# eliminations; anything else lists the (row, col, num) candidates it removes, and only
+# when at least one is still there.
+
+def naked_single(grid_size, box_size, candidates):
+    for index, mask in enumerate(candidates):
+        if mask and mask & (mask - 1) == 0:
+            return Hint("naked_single", index // grid_size, index % grid_size, mask.bit_length(), ())
+    return None
+
+def hidden_single(grid_size, box_size, candidates):
+    for unit in unit_cells(grid_size, box_size):
+        once = twice = 0
+        for index in unit:
+            twice |= once & candidates[index]
+            once |= candidates[index]
+        hidden = once & ~twice
+        if hidden:
+            bit = hidden & -hidden
+            for index in unit:
+                if candidates[index] & bit:
+                    return Hint("hidden_single", index // grid_size, index % grid_size, bit.bit_length(), ())
+    return None
+
+def pointing(grid_size, box_size, candidates):
+    # A digit confined to one line inside a box leaves the rest of that line
+    units = unit_cells(grid_size, box_size)
+    for box in units[2 * grid_size:]:
+        for num in range(1, grid_size + 1):
+            bit = 1 << (num - 1)
+            cells = [index for index in box if candidates[index] & bit]
+            if len(cells) < 2:
+                continue
+            for line in (cells[0] // grid_size, grid_size + cells[0] % grid_size):
+                if all(index in units[line] for index in cells):
+                    eliminations = tuple((index // grid_size, index % grid_size, num) for index in units[line]
+                                         if index not in box and candidates[index] & bit)
+                    if eliminations:
+                        return Hint("pointing", cells[0] // grid_size, cells[0] % grid_size, num, eliminations)
+    return None
+
+def claiming(grid_size, box_size, candidates):
+    # A digit confined to one box inside a line leaves the rest of that box
+    units = unit_cells(grid_size, box_size)
+    for line in units[:2 * grid_size]:
+        for num in range(1, grid_size + 1):
+            bit = 1 << (num - 1)
+            cells = [index for index in line if candidates[index] & bit]
+            if len(cells) < 2:
+                continue
+            box = box_index(cells[0] // grid_size, cells[0] % grid_size, box_size)
+            if all(box_index(index // grid_size, index % grid_size, box_size) == box for index in cells):
+                eliminations = tuple((index // grid_size, index % grid_size, num) for index in units[2 * grid_size + box]
+                                     if index not in line and candidates[index] & bit)
+                if eliminations:
+                    return Hint("claiming", cells[0] // grid_size, cells[0] % grid_size, num, eliminations)
+    return None
+
+def naked_subset(size, name):
+    # size cells of a unit sharing size digits between them take those digits from the rest of the unit
+    def technique(grid_size, box_size, candidates):
+        for unit in unit_cells(grid_size, box_size):
+            cells = [index for index in unit if candidates[index] and popcount(candidates[index]) <= size]
+            for combo in itertools.combinations(cells, size):
+                mask = 0
+                for index in combo:
+                    mask |= candidates[index]
+                if popcount(mask) != size:
+                    continue
+                eliminations = tuple((index // grid_size, index % grid_size, num) for index in unit
+                                     if index not in combo for num in cell_digits(candidates[index] & mask))
+                if eliminations:
+                    return Hint(name, combo[0] // grid_size, combo[0] % grid_size, cell_digits(mask)[0], eliminations)
+        return None
+    return technique
+
+def hidden_subset(size, name):
+    # size digits that only fit in the same size cells of a unit clear every other digit from those cells
+    def technique(grid_size, box_size, candidates):
+        for unit in unit_cells(grid_size, box_size):
+            places = {}
+            for num in range(1, grid_size + 1):
+                cells = [index for index in unit if candidates[index] >> (num - 1) & 1]
+                if 2 <= len(cells) <= size:
+                    places[num] = cells
+            for digits in itertools.combinations(places, size):
+                cells = set()
+                for num in digits:
+                    cells.update(places[num])
+                if len(cells) != size:
+                    continue
+                mask = sum(1 << (num - 1) for num in digits)
+                eliminations = tuple((index // grid_size, index % grid_size, num) for index in sorted(cells)
+                                     for num in cell_digits(candidates[index] & ~mask))
+                if eliminations:
+                    return Hint(name, min(cells) // grid_size, min(cells) % grid_size, digits[0], eliminations)
+        return None
+    return technique
+
+def fish(size, name):
+    # X-Wing (size 2) and Swordfish (3): a digit whose places in size rows fall in size
+    # columns is taken from the rest of those columns, and the same with rows and columns swapped
+    def technique(grid_size, box_size, candidates):
+        for num in range(1, grid_size + 1):
+            bit = 1 << (num - 1)
+            for by_rows in (True, False):
+                places = {}
+                for line in range(grid_size):
+                    cells = [line * grid_size + cross if by_rows else cross * grid_size + line for cross in range(grid_size)]
+                    crosses = [cross for cross, index in enumerate(cells) if candidates[index] & bit]
+                    if 2 <= len(crosses) <= size:
+                        places[line] = crosses
+                for lines in itertools.combinations(places, size):
+                    crosses = set()
+                    for line in lines:
+                        crosses.update(places[line])
+                    if len(crosses) != size:
+                        continue
+                    eliminations = []
+                    for cross in sorted(crosses):
+                        for line in range(grid_size):
+                            index = line * grid_size + cross if by_rows else cross * grid_size + line
+                            if line not in lines and candidates[index] & bit:
+                                eliminations.append((index // grid_size, index % grid_size, num))
+                    if eliminations:
+                        first = lines[0] * grid_size + min(crosses) if by_rows else min(crosses) * grid_size + lines[0]
+                        return Hint(name, first // grid_size, first % grid_size, num, tuple(eliminations))
+        return None
+    return technique
+
+# The grading ladder, easiest first, with the weight each step adds to a puzzle's score
+TECHNIQUES = [
+    ("hidden_single", 1, hidden_single),
+    ("naked_single", 2, naked_single),
+    ("pointing", 6, pointing),
+    ("claiming", 6, claiming),
+    ("naked_pair", 10, naked_subset(2, "naked_pair")),
+    ("hidden_pair", 12, hidden_subset(2, "hidden_pair")),
+    ("naked_triple", 15, naked_subset(3, "naked_triple")),
+    ("hidden_triple", 18, hidden_subset(3, "hidden_triple")),
+    ("x_wing", 20, fish(2, "x_wing")),
+    ("swordfish", 30, fish(3, "swordfish")),
+]
+TECHNIQUE_WEIGHTS = {name: weight for name, weight, _ in TECHNIQUES}
+# Added once when the ladder gets stuck and the rest needs trial and error
+GUESS_WEIGHT = 200
+
+def find_hint(grid_size, box_size, candidates):
+    # Next step for a player: a naked single, a hidden single, or a pointing pair/triple.
+    # None when none of these applies.
+    for technique in (naked_single, hidden_single, pointing):
+        hint = technique(grid_size, box_size, candidates)
+        if hint:
+            return hint
+    return None
+
+Grade = collections.namedtuple("Grade", "score hardest steps solved")
+
+@PROFILER.timed("grade_puzzle")
+def grade_puzzle(puzzle):
+    # Solves with the TECHNIQUES ladder, always taking the easiest step that applies.
+    # Returns a Grade: the summed weight of every step, the hardest technique needed
+    # ("guess" if the ladder got stuck), the steps per technique, and whether the ladder
+    # alone finished the puzzle.
+    grid_size = len(puzzle)
+    box_size = int(round(grid_size ** 0.5))
+    full_mask = (1 << grid_size) - 1
+    units = unit_cells(grid_size, box_size)
+    peers = peer_cells(grid_size, box_size)
+    flat = [num for row in puzzle for num in row]
+    used = [0] * (3 * grid_size)
+    for unit_number, unit in enumerate(units):
+        for index in unit:
+            if flat[index]:
+                used[unit_number] |= 1 << (flat[index] - 1)
+    candidates = [0 if flat[index] else full_mask & ~(used[index // grid_size] | used[grid_size + index % grid_size]
+                                                      | used[2 * grid_size + box_index(index // grid_size, index % grid_size, box_size)])
+                  for index in range(grid_size * grid_size)]
+    empty = flat.count(0)
+    steps = collections.Counter()
+    score = 0
+    hardest = None
+    while empty:
+        for name, weight, technique in TECHNIQUES:
+            hint = technique(grid_size, box_size, candidates)
+            if hint:
+                break
+        else:
+            return Grade(score + GUESS_WEIGHT, "guess", dict(steps), False)
+        steps[name] += 1
+        score += weight
+        if hardest is None or weight > TECHNIQUE_WEIGHTS[hardest]:
+            hardest = name
+        if hint.eliminations:
+            for row, col, num in hint.eliminations:
+                candidates[row * grid_size + col] &= ~(1 << (num - 1))
+        else:
+            index = hint.row * grid_size + hint.col
+            bit = 1 << (hint.num - 1)
+            for peer in peers[index]:
+                candidates[peer] &= ~bit
+            candidates[index] = 0
+            empty -= 1
+    return Grade(score, hardest, dict(steps), True)
+
+class BoardTracker:
+    # Conflict index: for every row, column and box, the cells holding each digit.
+    # Placements and erases update it in O(1), which keeps completion, move validity
+    # and the red state of every affected cell exact without rescanning the board.
+    # The red flags live in board.errors; without a board one is built from the grid.
+    # candidates[row * n + col] is the bitmask of digits no peer holds yet, refreshed
+    # for the ~20 (9x9) or ~40 (16x16) peers of each placed or removed digit.
+    def __init__(self, grid, box_size, board=None):
+        self.grid_size = len(grid)
+        self.box_size = box_size
+        self.filled = 0
+        self.duplicates = 0
+        self.row_cells = [[set() for _ in range(self.grid_size + 1)] for _ in range(self.grid_size)]
+        self.col_cells = [[set() for _ in range(self.grid_size + 1)] for _ in range(self.grid_size)]
+        self.box_cells = [[set() for _ in range(self.grid_size + 1)] for _ in range(self.grid_size)]
+        self.conflicts = [[0 for _ in range(self.grid_size)] for _ in range(self.grid_size)]
+        self.board = board or Board.from_grid(grid, box_size)
+        self.error_cells = self.board.errors_view()
+        self.full_mask = (1 << self.grid_size) - 1
+        self.row_used = [0] * self.grid_size
+        self.col_used = [0] * self.grid_size
+        self.box_used = [0] * self.grid_size
+        self.candidates = mask_array(self.grid_size, self.full_mask)
+        self.peers = peer_cells(self.grid_size, box_size)
+        for row in range(self.grid_size):
+            for col in range(self.grid_size):
+                if grid[row][col]:
+                    self.add(row, col, grid[row][col], refresh=False)
+        # One pass over the board instead of a peer refresh per given
+        self.refresh_all_candidates()
+
+    def units(self, row, col):
+        return (self.row_cells[row], self.col_cells[col], self.box_cells[box_index(row, col, self.box_size)])
+
+    def adjust_conflicts(self, row, col, delta):
+        self.conflicts[row][col] += delta
+        self.board.set_error(row, col, self.conflicts[row][col] > 0)
+
+    def is_valid_move(self, row, col, num):
+        return all(not (cells[num] - {(row, col)}) for cells in self.units(row, col))
+
+    def refresh_candidates(self, row, col, num):
+        bit = 1 << (num - 1)
+        box = box_index(row, col, self.box_size)
+        for used, unit, cells in ((self.row_used, row, self.row_cells[row]), (self.col_used, col, self.col_cells[col]),
+                                  (self.box_used, box, self.box_cells[box])):
+            used[unit] = used[unit] | bit if cells[num] else used[unit] & ~bit
+        n = self.grid_size
+        for index in self.peers[row * n + col]:
+            peer_row, peer_col = divmod(index, n)
+            self.candidates[index] = self.full_mask & ~(self.row_used[peer_row] | self.col_used[peer_col]
+                                                        | self.box_used[box_index(peer_row, peer_col, self.box_size)])
+
+    def refresh_all_candidates(self):
+        n = self.grid_size
+        for used, units in ((self.row_used, self.row_cells), (self.col_used, self.col_cells), (self.box_used, self.box_cells)):
+            for unit, cells in enumerate(units):
+                used[unit] = sum(1 << (num - 1) for num in range(1, n + 1) if cells[num])
+        for index in range(n * n):
+            row, col = divmod(index, n)
+            self.candidates[index] = self.full_mask & ~(self.row_used[row] | self.col_used[col]
+                                                        | self.box_used[box_index(row, col, self.box_size)])
+
+    def add(self, row, col, num, refresh=True):
+        self.filled += 1
+        for cells in self.units(row, col):
+            holders = cells[num]
+            if holders:
+                self.duplicates += 1
+                self.adjust_conflicts(row, col, len(holders))
+                for other_row, other_col in holders:
+                    self.adjust_conflicts(other_row, other_col, 1)
+            holders.add((row, col))
+        if refresh:
+            self.refresh_candidates(row, col, num)
+
+    def remove(self, row, col, num):
+        self.filled -= 1
+        for cells in self.units(row, col):
+            holders = cells[num]
+            holders.discard((row, col))
+            if holders:
+                self.duplicates -= 1
+                self.adjust_conflicts(row, col, -len(holders))
+                for other_row, other_col in holders:
+                    self.adjust_conflicts(other_row, other_col, -1)
+        self.refresh_candidates(row, col, num)
+
+    def is_full(self):
+        return self.filled == self.grid_size * self.grid_size
+
+    def is_solved(self):
+        return self.is_full() and self.duplicates == 0
+
+class MoveJournal:
+    # Append-only record of one game, one JSON list per line:
+    #   ["g", header]                          puzzle, solution, seed, difficulty, chances
+    #   ["m", row, col, num, notes, mistakes, max_mistakes]   a cell after a move
+    #   ["u", row, col, num, notes] / ["r", ...]               a cell after undo / redo
+    #   ["c", max_mistakes, chances_bought]    chances bought
+    #   ["s", cells, notes, mistakes, max_mistakes, elapsed]  full snapshot
+    #   ["t", elapsed]                         game time, written with every flush, and on
+    #                                          its own while the clock runs with no moves
+    # Entries are buffered and written (and fsynced) together, so a keystroke costs a
+    # list append; a crash loses at most the last unflushed moves. A torn line is skipped
+    # on reading and cut off before the journal is appended to again.
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.pending = []
+        self.since_snapshot = 0
+        self.elapsed = 0
+        # Game time of the last "t" entry written
+        self.saved_elapsed = 0
+        self.last_flush = time.monotonic()
+
+    def start(self, header):
+        # A new game replaces whatever was saved before
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.pending = [json.dumps(["g", header], separators=(",", ":"))]
+        self.flush()
+
+    def reopen(self):
+        # New entries would run on from a torn last line, so the file is first cut back
+        # to its last complete line
+        with open(self.path, "rb+") as f:
+            f.truncate(f.read().rfind(b"\n") + 1)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, entry):
+        self.pending.append(json.dumps(entry, separators=(",", ":")))
+        if entry[0] in ("m", "u", "r"):
+            self.since_snapshot += 1
+
+    def maybe_flush(self, elapsed):
+        self.elapsed = elapsed
+        if len(self.pending) >= JOURNAL_FLUSH_MOVES or time.monotonic() - self.last_flush >= JOURNAL_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if self.file is None or not self.pending and self.elapsed == self.saved_elapsed:
+            return
+        self.pending.append(json.dumps(["t", self.elapsed], separators=(",", ":")))
+        try:
+            self.file.write("\n".join(self.pending) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as e:
+            print(f"Move journal not written: {e}")
+        self.pending = []
+        self.saved_elapsed = self.elapsed
+
+    def close(self, finished=False):
+        # A finished game leaves nothing to resume
+        if self.file is None:
+            return
+        if not finished:
+            self.flush()
+        self.file.close()
+        self.file = None
+        if finished:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def read(path):
+        # (header, entries from the last readable snapshot on), or None without a usable
+        # journal. Lines before that snapshot are never parsed.
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.read().split("\n")
+        except OSError:
+            return None
+        try:
+            kind, header = json.loads(lines[0])
+        except (ValueError, TypeError):
+            return None
+        if kind != "g":
+            return None
+        start = 1
+        entries = []
+        for index in range(len(lines) - 1, 0, -1):
+            if lines[index].startswith('["s"'):
+                try:
+                    entries.append(json.loads(lines[index]))
+                except ValueError:
+                    # Torn while written; the snapshot before it still holds
+                    continue
+                start = index + 1
+                break
+        for line in lines[start:]:
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # A torn write; whatever was appended after it still counts
+                continue
+        return header, entries
+
+class GameSession:
+    # State and rules of one game with no UI attached: the grid, givens, notes, live
+    # conflicts and the remaining mistakes (max_mistakes, as in the game's header).
+    # Everything per cell lives in one compact Board; grid, original_cells, error_cells
+    # and notes are [row][col] views over it. seed and dificultate name the puzzle when known.
+    def __init__(self, puzzle, solution=None, max_mistakes=3, seed=None, dificultate=None):
+        self.grid_size = len(puzzle)
+        self.seed = seed
+        self.dificultate = dificultate
+        self.box_size = int(round(self.grid_size ** 0.5))
+        self.board = Board.from_grid(puzzle, self.box_size)
+        self.grid = self.board.grid_view()
+        self.solution = solution
+        self.original_cells = self.board.givens_view()
+        self.tracker = BoardTracker(self.grid, self.box_size, self.board)
+        self.error_cells = self.tracker.error_cells
+        self.notes = self.board.notes_view()
+        # Candidates ruled out by pointing hints; dropped whenever a digit is taken back,
+        # since they may rest on it
+        self.eliminated = mask_array(self.grid_size)
+        self.max_mistakes = max_mistakes
+        self.mistakes = 0
+        self.chances_bought = 0
+        self.game_over = False
+        # Moves as (row, col, (num, notes) before, (num, notes) after); undo pops one and
+        # writes its before state back, redo the reverse
+        self.history = []
+        self.redone = []
+        self.journal = None
+
+    def can_edit(self, row, col, num=None):
+        if num is not None and not 1 <= num <= self.grid_size:
+            return False
+        return not self.game_over and not self.board.is_given(row, col)
+
+    def place(self, row, col, num):
+        # True for a valid move, False for a mistake, None when the move is not allowed
+        if not self.can_edit(row, col, num):
+            return None
+        old = self.board.get(row, col)
+        if old:
+            self.tracker.remove(row, col, old)
+            self.forget_eliminations()
+        before = self.cell_state(row, col)
+        self.board.set(row, col, num)
+        self.tracker.add(row, col, num)
+        self.board.clear_notes(row, col)
+        valid = self.tracker.is_valid_move(row, col, num)
+        if not valid:
+            self.mistakes += 1
+            self.max_mistakes -= 1
+            if self.max_mistakes <= 0:
+                self.game_over = True
+        self.record(row, col, before)
+        return valid
+
+    def erase(self, row, col):
+        if self.board.is_given(row, col):
+            return False
+        before = self.cell_state(row, col)
+        old = self.board.get(row, col)
+        if old:
+            self.tracker.remove(row, col, old)
+            self.forget_eliminations()
+        self.board.set(row, col, 0)
+        self.board.clear_notes(row, col)
+        self.record(row, col, before)
+        return True
+
+    def toggle_note(self, row, col, num):
+        if not self.can_edit(row, col, num):
+            return False
+        before = self.cell_state(row, col)
+        self.board.toggle_note(row, col, num)
+        self.record(row, col, before)
+        return True
+
+    def cell_state(self, row, col):
+        index = row * self.grid_size + col
+        return self.board.cells[index], self.board.notes[index]
+
+    def set_cell(self, row, col, num, notes):
+        # Writes a digit and notes straight into a cell, keeping conflicts and candidates
+        # in step; undo, redo and journal replay all go through here
+        old = self.board.get(row, col)
+        if old != num:
+            if old:
+                self.tracker.remove(row, col, old)
+                self.forget_eliminations()
+            self.board.set(row, col, num)
+            if num:
+                self.tracker.add(row, col, num)
+        self.board.notes[row * self.grid_size + col] = notes
+
+    def record(self, row, col, before):
+        after = self.cell_state(row, col)
+        if after == before:
+            return
+        self.history.append((row, col, before, after))
+        self.redone = []
+        self.log(["m", row, col, after[0], after[1], self.mistakes, self.max_mistakes])
+
+    def undo(self):
+        # Takes back the last move and returns its cell, or None. Mistakes stay counted.
+        if self.game_over or not self.history:
+            return None
+        move = self.history.pop()
+        row, col, before, _ = move
+        self.set_cell(row, col, *before)
+        self.redone.append(move)
+        self.log(["u", row, col, *before])
+        return row, col
+
+    def redo(self):
+        if self.game_over or not self.redone:
+            return None
+        move = self.redone.pop()
+        row, col, _, after = move
+        self.set_cell(row, col, *after)
+        self.history.append(move)
+        self.log(["r", row, col, *after])
+        return row, col
+
+    def log(self, entry):
+        if self.journal is None:
+            return
+        self.journal.append(entry)
+        if self.journal.since_snapshot >= JOURNAL_SNAPSHOT_MOVES:
+            self.log_snapshot()
+
+    def log_snapshot(self):
+        # Also taken after auto-notes and hints, which rewrite notes all over the board
+        if self.journal is None:
+            return
+        self.journal.since_snapshot = 0
+        self.journal.append(["s", format_grid(self.board.to_lists()), list(self.board.notes),
+                             self.mistakes, self.max_mistakes, self.journal.elapsed])
+
+    def start_journal(self, path, dificultate):
+        self.journal = MoveJournal(path)
+        self.journal.start({"dificultate": dificultate, "seed": self.seed, "max_mistakes": self.max_mistakes,
+                            "puzzle": format_grid([[num if given else 0 for num, given in zip(row, givens)]
+                                                   for row, givens in zip(self.grid, self.original_cells)]),
+                            "solution": format_grid(self.solution) if self.solution else None})
+
+    def replay(self, entry):
+        kind = entry[0]
+        if kind == "m":
+            _, row, col, num, notes, self.mistakes, self.max_mistakes = entry
+            before = self.cell_state(row, col)
+            self.set_cell(row, col, num, notes)
+            self.history.append((row, col, before, (num, notes)))
+            self.redone = []
+            self.game_over = self.max_mistakes <= 0
+        elif kind in ("u", "r"):
+            _, row, col, num, notes = entry
+            undo = kind == "u"
+            moves, other = (self.history, self.redone) if undo else (self.redone, self.history)
+            if moves:
+                other.append(moves.pop())
+            self.set_cell(row, col, num, notes)
+        elif kind == "c":
+            self.max_mistakes = entry[1]
+            # Older saves did not count the chances bought
+            self.chances_bought = entry[2] if len(entry) > 2 else self.chances_bought
+            self.game_over = self.max_mistakes <= 0
+        elif kind == "s":
+            _, cells, notes, self.mistakes, self.max_mistakes, _ = entry
+            # The whole board is rewritten and re-indexed in one pass, which is far
+            # cheaper than going through set_cell for every changed cell
+            cells = parse_puzzle(cells)
+            for row in range(self.grid_size):
+                for col in range(self.grid_size):
+                    if not self.board.is_given(row, col):
+                        self.board.set(row, col, cells[row][col])
+                        self.board.notes[row * self.grid_size + col] = notes[row * self.grid_size + col]
+            self.board.errors = 0
+            self.tracker = BoardTracker(self.grid, self.box_size, self.board)
+            self.forget_eliminations()
+            self.game_over = self.max_mistakes <= 0
+
+    def forget_eliminations(self):
+        self.eliminated = mask_array(self.grid_size)
+
+    def candidates(self):
+        # Flat candidate bitmasks of the empty cells (0 for filled ones)
+        cells = self.board.cells
+        return [0 if cells[index] else mask & ~self.eliminated[index]
+                for index, mask in enumerate(self.tracker.candidates)]
+
+    def auto_notes(self):
+        # Fills the notes of every empty cell with its candidates
+        if self.game_over:
+            return False
+        for index, mask in enumerate(self.candidates()):
+            self.board.notes[index] = mask
+        self.log_snapshot()
+        return True
+
+    def hint(self):
+        # Finds the next step, records pointing eliminations and trims every note the
+        # candidates rule out. Returns the Hint, or None. A wrong digit, even one with no
+        # conflict, narrows its peers' candidates and could lead the step astray, so with
+        # the solution known the first one is pointed out instead ("wrong_digit").
+        if self.game_over:
+            return None
+        if self.solution:
+            for index, num in enumerate(self.board.cells):
+                row, col = divmod(index, self.grid_size)
+                if num and num != self.solution[row][col]:
+                    return Hint("wrong_digit", row, col, num, ())
+        hint = find_hint(self.grid_size, self.box_size, self.candidates())
+        if hint:
+            for row, col, num in hint.eliminations:
+                self.eliminated[row * self.grid_size + col] |= 1 << (num - 1)
+        notes = self.board.notes
+        for index, mask in enumerate(self.candidates()):
+            if notes[index]:
+                notes[index] &= mask
+        self.log_snapshot()
+        return hint
+
+    def add_chances(self, chances):
+        self.max_mistakes += chances
+        self.chances_bought += chances
+        if self.max_mistakes > 0:
+            self.game_over = False
+        self.log(["c", self.max_mistakes, self.chances_bought])
+
+    def is_solved(self):
+        return self.tracker.is_solved()
+
+    def is_started(self):
+        # A digit placed beyond the givens or a mistake made
+        filled = len(self.board.cells) - self.board.cells.count(0)
+        return self.mistakes > 0 or filled > bin(self.board.givens).count("1")
+
+class SudokuEngine:
+    # Creates game sessions; with a PuzzlePool attached the puzzles come pre-generated,
+    # and puzzles asked for by seed go through the PuzzleCache. A PuzzleLibrary, when it
+    # has the difficulty, takes precedence over both generation paths.
+    def __init__(self, puzzle_pool=None, puzzle_cache=None, library=None):
+        self.puzzle_pool = puzzle_pool
+        self.puzzle_cache = puzzle_cache
+        self.library = library
+        # Generates submit() misses when the pool has no worker processes
+        self.thread_executor = None
+
+    def generate(self, dificultate, seed=None):
+        # Returns (solution, puzzle, seed)
+        if seed:
+            if self.puzzle_cache:
+                return (*self.puzzle_cache.get(seed, dificultate), seed)
+            return (*seeded_puzzle(seed, dificultate), seed)
+        if self.library and self.library.count(dificultate):
+            return self.library.random(dificultate)
+        if self.puzzle_pool:
+            return self.puzzle_pool.take(dificultate)
+        seed = new_seed()
+        return (*seeded_puzzle(seed, dificultate), seed)
+
+    def submit(self, dificultate, seed=None):
+        # generate() for callers that must not block: a concurrent.futures.Future of
+        # (solution, puzzle, seed), already done when the library, cache or pool has the
+        # puzzle. A miss is generated by the pool's worker processes, or by a thread
+        # without them, and kept in the PuzzleCache when it was asked for by seed.
+        future = concurrent.futures.Future()
+        entry = None
+        if seed:
+            cached = self.puzzle_cache.lookup(seed, dificultate) if self.puzzle_cache else None
+            if cached:
+                entry = (*cached, seed)
+        elif self.library and self.library.count(dificultate):
+            entry = self.library.random(dificultate)
+        elif self.puzzle_pool:
+            entry = self.puzzle_pool.take_ready(dificultate)
+        if entry:
+            future.set_result(entry)
+            return future
+        keep = bool(seed and self.puzzle_cache)
+        seed = seed or new_seed()
+        job = self.puzzle_pool.submit(seed, dificultate) if self.puzzle_pool else None
+        if job is None:
+            job = self.executor().submit(seeded_puzzle, seed, dificultate)
+
+        def finished(job):
+            try:
+                solved_grid, puzzle = job.result()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            if keep:
+                self.puzzle_cache.put(seed, dificultate, (solved_grid, puzzle))
+            future.set_result(([row[:] for row in solved_grid], [row[:] for row in puzzle], seed))
+        job.add_done_callback(finished)
+        return future
+
+    def executor(self):
+        if self.thread_executor is None:
+            self.thread_executor = concurrent.futures.ThreadPoolExecutor(1)
+        return self.thread_executor
+
+    def new_session(self, dificultate, max_mistakes=3, seed=None, generated=None):
+        # generated: a (solution, puzzle, seed) from submit()
+        solution, puzzle, seed = generated or self.generate(dificultate, seed)
+        return GameSession(puzzle, solution, max_mistakes, seed, dificultate)
+
+def resume_session(path):
+    # Rebuilds a journaled game from its last snapshot and the entries after it. Returns
+    # (session, difficulty, elapsed seconds), or None when there is nothing to resume;
+    # the session keeps appending to the same journal.
+    journal = MoveJournal.read(path)
+    if journal is None:
+        return None
+    header, entries = journal
+    try:
+        solution = parse_puzzle(header["solution"]) if header.get("solution") else None
+        session = GameSession(parse_puzzle(header["puzzle"]), solution, header["max_mistakes"], header.get("seed"), header["dificultate"])
+        elapsed = 0
+        for entry in entries:
+            if entry[0] == "t":
+                elapsed = entry[1]
+            else:
+                if entry[0] == "s":
+                    elapsed = entry[5]
+                session.replay(entry)
+    except (KeyError, TypeError, ValueError, IndexError) as e:
+        print(f"Saved game not resumed: {e}")
+        return None
+    if session.is_solved():
+        return None
+    session.journal = MoveJournal(path)
+    session.journal.elapsed = session.journal.saved_elapsed = elapsed
+    session.journal.reopen()
+    return session, header["dificultate"], elapsed
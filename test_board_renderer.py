@@ -0,0 +1,45 @@
+import importlib.util
+import os
+import random
+
+import pytest
+
+import sudoku_engine
+
+pytest.importorskip("pygame")
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+def load_game():
+    spec = importlib.util.spec_from_file_location("var_final", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Var final.py"))
+    game = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(game)
+    game.init_display()
+    return game
+
+def frame(game, renderer, screen, session):
+    renderer.draw(screen, session.grid, session.notes, None, session.error_cells, 0, False, session.max_mistakes)
+    return game.pygame.image.tobytes(screen, "RGB")
+
+def test_resumed_digits_are_redrawn(tmp_path):
+    game = load_game()
+    path = tmp_path / "save.jsonl"
+    solution, puzzle = sudoku_engine.generate_puzzle("usor", rng=random.Random(1))
+    session = sudoku_engine.GameSession(puzzle, solution, seed="test", dificultate="usor")
+    session.start_journal(str(path), "usor")
+    placed = [(row, col) for row in range(9) for col in range(9) if not session.grid[row][col]][:3]
+    for row, col in placed:
+        session.place(row, col, session.solution[row][col])
+    session.journal.close()
+    session, _, _ = sudoku_engine.resume_session(str(path))
+
+    screen = game.pygame.Surface((600, 660))
+    renderer = game.BoardRenderer(session.grid, session.original_cells, 9, 3, 600, 660)
+    frame(game, renderer, screen, session)
+    session.erase(*placed[0])
+    session.undo()
+    session.erase(*placed[1])
+    dirty = frame(game, renderer, screen, session)
+    renderer.invalidate()
+    assert dirty == frame(game, renderer, screen, session)
+    session.journal.close()
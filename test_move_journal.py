@@ -0,0 +1,81 @@
+import random
+
+import sudoku_engine
+
+def new_game(path):
+    solution, puzzle = sudoku_engine.generate_puzzle("usor", rng=random.Random(1))
+    session = sudoku_engine.GameSession(puzzle, solution, seed="test", dificultate="usor")
+    session.start_journal(str(path), "usor")
+    return session
+
+def empty_cells(session):
+    return [(row, col) for row in range(session.grid_size) for col in range(session.grid_size)
+            if not session.grid[row][col]]
+
+def play(session, count):
+    for row, col in empty_cells(session)[:count]:
+        assert session.place(row, col, session.solution[row][col])
+
+def filled(session):
+    return sum(1 for row in session.grid for num in row if num)
+
+def resume(path):
+    session, dificultate, _ = sudoku_engine.resume_session(str(path))
+    assert dificultate == "usor"
+    return session
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "save.jsonl"
+    session = new_game(path)
+    play(session, 4)
+    session.toggle_note(*empty_cells(session)[0], 5)
+    session.undo()
+    session.add_chances(10)
+    session.journal.close()
+    resumed = resume(path)
+    assert resumed.board.to_lists() == session.board.to_lists()
+    assert list(resumed.board.notes) == list(session.board.notes)
+    assert resumed.max_mistakes == session.max_mistakes
+    assert resumed.chances_bought == 10
+    assert len(resumed.history) == len(session.history)
+    assert resumed.redo() == session.redo()
+    resumed.journal.close()
+
+def test_resume_after_torn_write(tmp_path):
+    path = tmp_path / "save.jsonl"
+    session = new_game(path)
+    givens = filled(session)
+    play(session, 3)
+    session.journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('["m",0,0,')
+    session = resume(path)
+    assert filled(session) == givens + 3
+    # Entries appended after the torn line must survive the next resume
+    play(session, 5)
+    session.journal.close()
+    assert filled(resume(path)) == givens + 8
+
+def test_resume_after_torn_snapshot(tmp_path):
+    path = tmp_path / "save.jsonl"
+    session = new_game(path)
+    givens = filled(session)
+    play(session, 3)
+    session.log_snapshot()
+    play(session, 2)
+    session.journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('["s","12')
+    assert filled(resume(path)) == givens + 5
+
+def test_resume_keeps_idle_time(tmp_path):
+    path = tmp_path / "save.jsonl"
+    session = new_game(path)
+    play(session, 1)
+    session.journal.elapsed = 5
+    session.journal.flush()
+    session.journal.elapsed = 599
+    session.journal.close()
+    resumed, _, elapsed = sudoku_engine.resume_session(str(path))
+    resumed.journal.close()
+    assert elapsed == 599